@@ -1,45 +1,263 @@
+# Start the startup clock first so import time shows up in the timings
+from model_loader import StartupTimings, BackgroundModel
+startup = StartupTimings()
+
 import os
 import time
 import telebot
-from telebot import types
+from telebot import types, apihelper
 from dotenv import load_dotenv
-from transformers import pipeline
 from PIL import Image
 import io
 import traceback
-import requests
 import json
 import re
+import threading
+import atexit
+from receipt_engine import ReceiptBatcher, ReceiptImage, read_total, receipt_verdict
+from receipt_backends import load_scanner, rss_mb
+from receipt_prefilter import ReceiptPrefilter, parse_thresholds
+from receipt_hashes import ReceiptIndex, dhash
+from receipt_jobs import ReceiptJob, ReceiptJobQueue, VerdictCache, image_digest
+from geocoding import GeocodeCache, GeocoderUnavailable, NominatimClient
+from gazetteer import Gazetteer
+from workers import ChatExecutor, ChatOrderedBot, Scheduler
+from router import StepRouter
+from sessions import open_session_store
+from menu import Menu, format_rm
+from payment_qr import FileIdCache, AmountQRCache, file_key, sent_file_id
+from metrics import Metrics, SlowUpdateProfiler, start_metrics_server
+from webhook import WebhookServer
+from sharding import ShardDispatcher, current_shard, shard_path
+from ledger import OrderLedger
+from delivery import DeliveryZones
+startup.mark('imports')
 
 # --- CONFIGURATION ---
 load_dotenv()
 TOKEN = os.getenv('TELEGRAM_TOKEN')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
 HF_API_KEY = os.getenv('HUGGINGFACE_API_KEY')
 
+# Receipt batching: how many images go through the model at once, and how long
+# (ms) the first receipt in a batch may wait for others to join it
+RECEIPT_BATCH_SIZE = int(os.getenv('RECEIPT_BATCH_SIZE', '8'))
+RECEIPT_BATCH_WAIT_MS = int(os.getenv('RECEIPT_BATCH_WAIT_MS', '50'))
+# Receipts are downscaled to this longest side (px) before inference; 0 = keep full size
+RECEIPT_MAX_SIDE = int(os.getenv('RECEIPT_MAX_SIDE', '640'))
+
+# Inference backend: 'pipeline' (fp32), 'quantized' (int8 dynamic) or 'onnx' (ONNX Runtime graph)
+RECEIPT_BACKEND = os.getenv('RECEIPT_BACKEND', 'pipeline')
+RECEIPT_ONNX_PATH = os.getenv('RECEIPT_ONNX_PATH', 'vilt.onnx')
+# CPU threads for inference (0 = library default)
+RECEIPT_THREADS = int(os.getenv('RECEIPT_THREADS', '0'))
+# Cheap image heuristics before the model: 'reject' turns away obvious non-receipts
+# without running the model, 'off' sends everything to the model. It never approves.
+# Thresholds are overridden as name=value pairs (see receipt_prefilter.DEFAULT_THRESHOLDS)
+RECEIPT_PREFILTER = os.getenv('RECEIPT_PREFILTER', 'reject').lower()
+RECEIPT_PREFILTER_THRESHOLDS = os.getenv('RECEIPT_PREFILTER_THRESHOLDS', '')
+# Duplicate receipts: max Hamming distance (of 256 dHash bits) for a match,
+# how long (hours) a processed receipt is remembered, and max receipts remembered
+RECEIPT_DEDUP_DISTANCE = int(os.getenv('RECEIPT_DEDUP_DISTANCE', '8'))
+RECEIPT_DEDUP_MAX_AGE_HOURS = float(os.getenv('RECEIPT_DEDUP_MAX_AGE_HOURS', '720'))
+RECEIPT_DEDUP_MAX = int(os.getenv('RECEIPT_DEDUP_MAX', '50000'))
+# Receipt jobs: seconds until an unchecked receipt goes to manual review, checker
+# threads, max queued receipts (beyond that, straight to manual review), and
+# exact-file verdict cache size
+RECEIPT_DEADLINE_SECONDS = float(os.getenv('RECEIPT_DEADLINE_SECONDS', '60'))
+RECEIPT_JOB_WORKERS = int(os.getenv('RECEIPT_JOB_WORKERS', str(RECEIPT_BATCH_SIZE)))
+RECEIPT_QUEUE_MAX = int(os.getenv('RECEIPT_QUEUE_MAX', '500'))
+RECEIPT_VERDICT_CACHE = int(os.getenv('RECEIPT_VERDICT_CACHE', '10000'))
+# SQLite file for those verdicts, shared by all shard workers so a receipt reused
+# on a chat owned by another shard is still caught (empty = in-memory only)
+RECEIPT_VERDICT_DB = os.getenv('RECEIPT_VERDICT_DB', 'receipt_verdicts.sqlite3')
+# Receipts no one could check automatically are appended here for staff (empty = log only)
+REVIEW_DIR = os.getenv('REVIEW_DIR', 'manual_review')
+
+# 'background' starts polling immediately and loads the AI model on a thread;
+# 'eager' loads the model before polling starts (the old behaviour)
+MODEL_LOAD_MODE = os.getenv('MODEL_LOAD_MODE', 'background')
+# How long (s) a receipt waits for a still-loading model before going to manual review
+MODEL_READY_TIMEOUT = float(os.getenv('MODEL_READY_TIMEOUT', '120'))
+# Geocode cache: max entries, entry lifetime (hours) and optional SQLite file for persistence
+GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', '10000'))
+GEOCODE_CACHE_TTL_HOURS = float(os.getenv('GEOCODE_CACHE_TTL_HOURS', '168'))
+GEOCODE_CACHE_DB = os.getenv('GEOCODE_CACHE_DB', '')
+# Nominatim: base URL (point at a local stand-in for testing), requests per second, timeout (s)
+NOMINATIM_URL = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+NOMINATIM_RATE = float(os.getenv('NOMINATIM_RATE', '1.0'))
+NOMINATIM_TIMEOUT = float(os.getenv('NOMINATIM_TIMEOUT', '5'))
+# Offline gazetteer index tried before Nominatim (skipped if the file does not exist)
+GAZETTEER_INDEX = os.getenv('GAZETTEER_INDEX', 'gazetteer.json.gz')
+# Worker threads for handling updates (different chats run in parallel)
+HANDLER_WORKERS = int(os.getenv('HANDLER_WORKERS', '16'))
+# Seconds between the order confirmation and the "Rider Picked Up" message
+RIDER_PICKUP_DELAY = float(os.getenv('RIDER_PICKUP_DELAY', '2'))
+# Session store: 'memory' or 'sqlite', max chats kept in memory, idle expiry (hours)
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+SESSION_DB = os.getenv('SESSION_DB', 'sessions.sqlite3')
+SESSION_MAX = int(os.getenv('SESSION_MAX', '100000'))
+SESSION_TTL_HOURS = float(os.getenv('SESSION_TTL_HOURS', '24'))
+SESSION_FLUSH_SECONDS = float(os.getenv('SESSION_FLUSH_SECONDS', '2'))
+# Static DuitNow QR image, and the JSON file remembering its Telegram file_id
+QR_IMAGE_PATH = os.getenv('QR_IMAGE_PATH', r"c:\Users\Rafid Mahdi\nasi-kandar-bot\images\QR code.png")
+QR_FILE_ID_CACHE = os.getenv('QR_FILE_ID_CACHE', 'qr_file_ids.json')
+# Prometheus-style metrics endpoint (0 disables) and slow-update profiling
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+PROFILE_SLOW_UPDATE_MS = float(os.getenv('PROFILE_SLOW_UPDATE_MS', '2000'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# How updates arrive: 'polling' (getUpdates loop) or 'webhook' (embedded HTTP server).
+# WEBHOOK_URL is the public base URL registered with Telegram (leave empty to
+# register it yourself, e.g. when POSTing recorded updates locally)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Updates waiting for a worker before the webhook answers 503 (Telegram retries later)
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000'))
+# Multi-process mode: >1 shards chats across that many worker processes, with
+# receipts served by INFERENCE_WORKERS processes sharing one model load (needs fork)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '1'))
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '1000'))
+# Delivery outlets, tariffs and service areas (JSON, see data/outlets.example.json);
+# without the file we deliver from the KL City Centre kitchen up to 50km
+DELIVERY_ZONES_FILE = os.getenv('DELIVERY_ZONES_FILE', 'outlets.json')
+# Append-only order ledger: directory (empty disables), segment size (MB) and fsync batching window (ms)
+LEDGER_DIR = os.getenv('LEDGER_DIR', 'orders')
+LEDGER_SEGMENT_MB = float(os.getenv('LEDGER_SEGMENT_MB', '64'))
+LEDGER_FSYNC_MS = float(os.getenv('LEDGER_FSYNC_MS', '200'))
+# Optional JSONL file that collects startup timings of every run
+STARTUP_TIMINGS_LOG = os.getenv('STARTUP_TIMINGS_LOG')
+RELEASE = os.getenv('RELEASE')
+
+# Point the bot at another Bot API server (a local Bot API server, or benchmark.py's stand-in)
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + "/bot{0}/{1}"
+    apihelper.FILE_URL = TELEGRAM_API_URL.rstrip('/') + "/file/bot{0}/{1}"
+
 if not TOKEN:
     print("❌ Error: TELEGRAM_TOKEN not found in .env file.")
     exit()
 
-# Initialize bot
-bot = telebot.TeleBot(TOKEN)
+# --- SHARDED MODE: this process only routes updates; each worker re-runs this file ---
+shard = current_shard()
+if SHARD_WORKERS > 1 and shard is None:
+    dispatcher = ShardDispatcher(os.path.abspath(__file__), SHARD_WORKERS,
+                                 scanner_loader=lambda: load_scanner(RECEIPT_BACKEND,
+                                                                     onnx_path=RECEIPT_ONNX_PATH,
+                                                                     threads=RECEIPT_THREADS or None),
+                                 inference_workers=INFERENCE_WORKERS,
+                                 queue_size=SHARD_QUEUE_SIZE,
+                                 batch_size=RECEIPT_BATCH_SIZE,
+                                 max_wait=RECEIPT_BATCH_WAIT_MS / 1000.0,
+                                 threads=RECEIPT_THREADS or None).start()
+    if BOT_MODE == 'webhook':
+        webhook = WebhookServer(dispatcher=dispatcher, path=WEBHOOK_PATH, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                                secret_token=WEBHOOK_SECRET or None, max_pending=WEBHOOK_MAX_PENDING)
+        if WEBHOOK_URL:
+            telebot.TeleBot(TOKEN, threaded=False).set_webhook(url=WEBHOOK_URL.rstrip('/') + webhook.path,
+                                                               secret_token=WEBHOOK_SECRET or None)
+        print(f"⏱️ Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{webhook.path} for {SHARD_WORKERS} shards")
+        try:
+            webhook.serve_forever()
+        finally:
+            dispatcher.stop()
+    else:
+        print(f"⏱️ Polling started for {SHARD_WORKERS} shards")
+        dispatcher.run_polling(TOKEN)
+    exit()
+
+if shard is not None:
+    # This worker owns only its slice of the chats (and its own session file);
+    # the Nominatim rate limit is split between the workers
+    print(f"🧩 Shard worker {shard.index + 1}/{shard.count} starting")
+    SESSION_DB = shard_path(SESSION_DB, shard.index)
+    NOMINATIM_RATE = NOMINATIM_RATE / shard.count
+    if METRICS_PORT:
+        METRICS_PORT += shard.index
+
+# --- METRICS ---
+metrics = Metrics()
+profiler = SlowUpdateProfiler(metrics,
+                              threshold=PROFILE_SLOW_UPDATE_MS / 1000.0,
+                              sample_rate=PROFILE_SAMPLE_RATE,
+                              out_dir=PROFILE_DIR)
+
+# Time every Bot API call (sendMessage, sendPhoto, getFile, ...) by method name
+_make_request = apihelper._make_request
+def _timed_make_request(token, method_name, *args, **kwargs):
+    with metrics.timer('telegram_api_seconds', method=method_name):
+        return _make_request(token, method_name, *args, **kwargs)
+apihelper._make_request = _timed_make_request
+
+# Initialize bot — updates are handled on a worker pool, in order per chat
+chat_executor = ChatExecutor(max_workers=HANDLER_WORKERS)
+scheduler = Scheduler(chat_executor)
+with startup.phase('bot_init'):
+    bot = ChatOrderedBot(TOKEN, chat_executor, around_update=profiler.run)
 print("✅ Nasi Kandar Smart Bot is running...")
 
+
 # Initialize local document QA model (runs on your machine; requires transformers+torch+Pillow)
-print("⏳ Loading local AI Brain (this may take a minute the first time)...")
-ai_scanner = None
-try:
-    # Use visual-question-answering which runs OCR internally (no pytesseract required)
-    ai_scanner = pipeline(
-        "visual-question-answering",
-        model="dandelin/vilt-b32-finetuned-vqa"
-    )
-    print("✅ Local AI Brain (VQA) loaded — ready to verify receipts.")
-except Exception as e:
-    print(f"⚠️ Could not load local AI Brain: {e}")
-    ai_scanner = None
-
-# --- DATABASE (In-Memory) ---
-user_data = {}
+def load_receipt_model():
+    """
+    Import transformers, load the VQA model with the configured backend
+    (pipeline / quantized / onnx) and wrap it in the batching engine.
+    Returns the ReceiptBatcher, or None if the model could not be loaded.
+    """
+    if shard is not None:
+        # Served by the dispatcher's inference pool (one shared model load)
+        return shard.inference
+    print(f"⏳ Loading local AI Brain ({RECEIPT_BACKEND} backend, this may take a minute the first time)...")
+    try:
+        with startup.phase('import_transformers'):
+            import transformers
+
+        # Use visual-question-answering which runs OCR internally (no pytesseract required)
+        with startup.phase('model_load'):
+            ai_scanner = load_scanner(RECEIPT_BACKEND,
+                                      onnx_path=RECEIPT_ONNX_PATH,
+                                      threads=RECEIPT_THREADS or None)
+        print(f"✅ Local AI Brain (VQA, {RECEIPT_BACKEND}) loaded — ready to verify receipts. RSS {rss_mb():.0f} MB")
+    except Exception as e:
+        print(f"⚠️ Could not load local AI Brain: {e}")
+        return None
+    finally:
+        startup.mark('model_ready')
+        print(f"⏱️ Startup timings — {startup.report()}")
+
+    # All receipts share one batching engine so concurrent uploads run in one forward pass
+    return ReceiptBatcher(ai_scanner,
+                          max_batch_size=RECEIPT_BATCH_SIZE,
+                          max_wait=RECEIPT_BATCH_WAIT_MS / 1000.0)
+
+
+receipt_model = BackgroundModel(load_receipt_model, name="receipt-model").start()
+if MODEL_LOAD_MODE == 'eager':
+    receipt_model.wait()
+
+# --- DATABASE (Session Store) ---
+# Bounded per-chat order state; abandoned carts expire after SESSION_TTL_HOURS.
+# The sqlite backend writes changes behind in batches so orders survive restarts.
+user_data = open_session_store(backend=SESSION_BACKEND,
+                               path=SESSION_DB,
+                               maxsize=SESSION_MAX,
+                               ttl=SESSION_TTL_HOURS * 3600,
+                               flush_interval=SESSION_FLUSH_SECONDS)
+atexit.register(user_data.flush)
+
+# Completed orders, for the kitchen and accounting (`python ledger.py daily orders/`)
+order_ledger = None
+if LEDGER_DIR:
+    order_ledger = OrderLedger(LEDGER_DIR,
+                               name=f"orders.shard{shard.index}" if shard is not None else 'orders',
+                               segment_bytes=int(LEDGER_SEGMENT_MB * 1024 * 1024),
+                               fsync_interval=LEDGER_FSYNC_MS / 1000.0)
 
 # --- MENU DATA ---
 MENU_ITEMS = {
@@ -57,103 +275,204 @@ MENU_ITEMS = {
     '12': {'name': 'Satay Ayam (10 sticks)', 'price': 'RM 14.00'}
 }
 
+# Compiled once: integer-sen prices and the pre-rendered menu listings
+menu = Menu(MENU_ITEMS)
+MENU_TEXT = "🍛 *NASI KANDAR BISTROO MENU* 🍛\n\nTo order, just *reply with the number*:\n\n" + menu.listing
+ADD_MORE_TEXT = "🍛 *ADD MORE ITEMS TO YOUR ORDER* 🍛\n\nReply with the number to add:\n\n" + menu.listing
+DEFAULT_DELIVERY_SEN = 500
+
+# --- HELPER: RECEIPT PRE-FILTER (cheap heuristics before the model) ---
+prefilter = None
+if RECEIPT_PREFILTER != 'off':
+    prefilter = ReceiptPrefilter(parse_thresholds(RECEIPT_PREFILTER_THRESHOLDS))
+
 # --- HELPER FUNCTION: HUGGING FACE VQA RECEIPT VERIFICATION ---
 def verify_receipt_locally(image_bytes):
     """
-    Verify receipt by running a local visual-question-answering model.
-    Returns True if it looks like a receipt with a total amount, False otherwise.
+    Verify receipt in stages: cheap image heuristics first, then (only for
+    ambiguous images) a local visual-question-answering model.
+    Accepts raw image bytes or an already decoded ReceiptImage.
+    Returns True if it looks like a receipt with a total amount, False if not,
+    and None if it could not be checked (it then needs a person, not approval).
     """
-    if not ai_scanner:
-        # No local model available — accept to avoid blocking users
-        return True
+    return check_receipt(image_bytes)[0]
 
-    # Save image temporarily
-    tmp_path = "tmp_receipt.jpg"
+
+def check_receipt(image_bytes, timeout=None):
+    """
+    Like verify_receipt_locally, but returns (verdict, stage, total) where stage
+    is 'prefilter' or 'model' for a real decision and total is the amount the
+    model read (None from the pre-filter), or (None, None, None) when the
+    receipt could not be checked within `timeout` seconds (no model, decode or
+    inference failure, deadline).
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    receipt = image_bytes
+    if not isinstance(receipt, ReceiptImage):
+        receipt = ReceiptImage(image_bytes, max_side=RECEIPT_MAX_SIDE)
+
+    # Decode in memory once (no temp file); the model gets the downscaled copy
     try:
-        with open(tmp_path, 'wb') as f:
-            f.write(image_bytes)
-        
+        model_image = receipt.model_image
+    except Exception as e:
+        print(f"Failed to decode image for local verification: {e}")
+        return None, None, None
+
+    # Stage 1: milliseconds of image statistics settle the obvious cases
+    if prefilter is not None:
         try:
-            # Ask if it's a receipt
-            result1 = ai_scanner(image=tmp_path, question="Is this a receipt?")
-            print("Is receipt result:", result1)
-            
-            # Ask for the total amount
-            result2 = ai_scanner(image=tmp_path, question="How much is the total?")
-            print("Total amount result:", result2)
-            
-            # Check if both answers are confident
-            is_receipt_confident = False
-            total_confident = False
-            
-            if isinstance(result1, dict):
-                is_receipt_confident = result1.get('score', 0) > 0.5 and 'yes' in result1.get('answer', '').lower()
-            elif isinstance(result1, list) and len(result1) > 0:
-                is_receipt_confident = result1[0].get('score', 0) > 0.5 and 'yes' in result1[0].get('answer', '').lower()
-            
-            if isinstance(result2, dict):
-                total_confident = result2.get('score', 0) > 0.5 and result2.get('answer', '') != ''
-            elif isinstance(result2, list) and len(result2) > 0:
-                total_confident = result2[0].get('score', 0) > 0.5 and result2[0].get('answer', '') != ''
-            
-            return is_receipt_confident and total_confident
+            with metrics.timer('receipt_prefilter_seconds'):
+                decision, reason = prefilter.check(receipt.image)
+            metrics.inc('receipt_prefilter_total', decision=decision, reason=reason)
+            if decision == 'reject':
+                print(f"Receipt pre-filter: rejected ({reason})")
+                return False, 'prefilter', None
         except Exception as e:
-            print(f"Local AI verification failed: {e}")
-            traceback.print_exc()
-            return True
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            print(f"Receipt pre-filter failed, falling back to the model: {e}")
+
+    # Stage 2: queue behind a model that is still loading in the background
+    wait = MODEL_READY_TIMEOUT if deadline is None else min(MODEL_READY_TIMEOUT, max(0.0, deadline - time.monotonic()))
+    receipt_batcher = receipt_model.wait(wait)
+    if not receipt_batcher:
+        print("Local AI model not available — receipt left for manual review")
+        return None, None, None
+
+    try:
+        # Both questions are answered in the engine's next batched forward pass
+        with metrics.timer('receipt_inference_seconds'):
+            result1, result2 = receipt_batcher.verify(
+                model_image, None if deadline is None else max(0.0, deadline - time.monotonic()))
+        print("Is receipt result:", result1)
+        print("Total amount result:", result2)
+
+        # Check if both answers are confident
+        return receipt_verdict(result1, result2), 'model', read_total(result2)
     except Exception as e:
-        print(f"Failed to save image for local verification: {e}")
-        return True
+        print(f"Local AI verification failed: {e!r}")
+        traceback.print_exc()
+        return None, None, None
+
+# --- HELPER: DUPLICATE RECEIPT INDEX (perceptual hashes) ---
+receipt_index = ReceiptIndex(max_distance=RECEIPT_DEDUP_DISTANCE,
+                             max_age=RECEIPT_DEDUP_MAX_AGE_HOURS * 3600,
+                             maxsize=RECEIPT_DEDUP_MAX)
+
+# --- HELPER: SHARED NOMINATIM CLIENT (pooled, rate-limited, cached) ---
+geocode_cache = GeocodeCache(maxsize=GEOCODE_CACHE_SIZE,
+                             ttl=GEOCODE_CACHE_TTL_HOURS * 3600,
+                             db_path=GEOCODE_CACHE_DB or None)
+geocoder = NominatimClient(base_url=NOMINATIM_URL,
+                           rate=NOMINATIM_RATE,
+                           timeout=NOMINATIM_TIMEOUT,
+                           cache=geocode_cache,
+                           metrics=metrics)
+
+# Optional offline gazetteer (built with `python gazetteer.py build ...`)
+gazetteer = None
+if GAZETTEER_INDEX and os.path.exists(GAZETTEER_INDEX):
+    try:
+        with startup.phase('gazetteer_load'):
+            gazetteer = Gazetteer.load(GAZETTEER_INDEX)
+        print(f"✅ Offline gazetteer loaded ({len(gazetteer)} places).")
+    except Exception as e:
+        print(f"⚠️ Could not load gazetteer: {e}")
+        gazetteer = None
+
+
+def reverse_geocode(lat, lon):
+    """Reverse geocode via the offline gazetteer first, then Nominatim."""
+    if gazetteer:
+        local = gazetteer.reverse(lat, lon)
+        if local:
+            return local
+    return geocoder.reverse(lat, lon)
+
+
+# --- HELPER: DELIVERY ZONES (nearest outlet, distance and fee) ---
+DEFAULT_OUTLETS = [{'name': 'KL City Centre', 'lat': 3.1390, 'lon': 101.6869,
+                    'max_km': 50, 'base_fee': 2.00, 'per_km': 0.50}]
+if os.path.exists(DELIVERY_ZONES_FILE):
+    delivery_zones = DeliveryZones.from_file(DELIVERY_ZONES_FILE)
+    print(f"🏪 {len(delivery_zones)} outlets loaded from {DELIVERY_ZONES_FILE}")
+else:
+    delivery_zones = DeliveryZones(DEFAULT_OUTLETS)
+
+
+def delivery_not_possible(chat_id, quote):
+    if quote.reason == 'outside_area':
+        bot.send_message(chat_id,
+                         "❌ **Outside Our Delivery Area**\n\n"
+                         "None of our outlets deliver to this location yet.\n\n"
+                         "Please provide a different address or contact us directly.")
+        return
+    bot.send_message(chat_id,
+                     f"❌ **Too Far for Delivery**\n\n"
+                     f"Your location is {quote.distance_km:.1f}km away.\n"
+                     f"Maximum delivery distance is {quote.outlet.get('max_km', 50):g}km.\n\n"
+                     f"Please provide a different address or contact us directly.")
+
 
 # --- NEW HELPER: REAL ADDRESS CHECKER (Free) ---
-def validate_address_osm(address_text):
-    headers = {'User-Agent': 'NasiKandarBot/1.0'}
-    url = "https://nominatim.openstreetmap.org/search"
-    
-    # --- ATTEMPT 1: EXACT SEARCH ---
-    # Try the full address first
-    params = {'q': address_text, 'countrycodes': 'my', 'format': 'json', 'limit': 1}
-    response = requests.get(url, params=params, headers=headers).json()
-    if len(response) > 0:
-        return {'valid': True, 'name': response[0]['display_name'], 'lat': response[0]['lat'], 'lon': response[0]['lon']}
-    
-    # --- ATTEMPT 2: INTELLIGENT CLEANING ---
-    # If exact failed, remove specific unit details (Block, Unit, Level, No)
-    print(f"Exact search failed. Cleaning address: {address_text}")
-    
+def address_queries(address_text):
+    """The queries validate_address_osm tries, in order: exact, cleaned, first 3 words."""
+    queries = [address_text]
+
     # This removes things like "Block A", "Unit 5", "No. 12"
     clean_text = re.sub(r'(?i)(block|unit|level|lot|suite|no\.?)\s*\w+', '', address_text)
     clean_text = re.sub(r'[^\w\s,]', '', clean_text) # Remove special chars like ; : ( )
-    
     # Remove extra spaces
     clean_text = " ".join(clean_text.split())
-    
-    params['q'] = clean_text
-    response = requests.get(url, params=params, headers=headers).json()
-    if len(response) > 0:
-        return {'valid': True, 'name': response[0]['display_name'], 'lat': response[0]['lat'], 'lon': response[0]['lon']}
+    queries.append(clean_text)
 
-    # --- ATTEMPT 3: FIRST 3 WORDS (FALLBACK) ---
     # Just take the first few words (usually the building name) + "Malaysia"
     words = address_text.split()
     if len(words) > 2:
-        short_query = " ".join(words[:3]) + " Malaysia"
-        params['q'] = short_query
-        response = requests.get(url, params=params, headers=headers).json()
-        if len(response) > 0:
-            return {'valid': True, 'name': response[0]['display_name'], 'lat': response[0]['lat'], 'lon': response[0]['lon']}
+        queries.append(" ".join(words[:3]) + " Malaysia")
+    return queries
+
+
+def validate_address_osm(address_text):
+    queries = address_queries(address_text)
+
+    # --- STAGE 1: OFFLINE GAZETTEER ---
+    # Answer locally for known landmarks and postcodes; bare city matches only
+    # when the query is little more than the city name
+    if gazetteer:
+        with metrics.timer('geocode_stage_seconds', stage='gazetteer'):
+            for query in queries:
+                response = gazetteer.search(query)
+                if len(response) > 0:
+                    metrics.inc('geocode_results_total', source='gazetteer')
+                    return {'valid': True, 'name': response[0]['display_name'], 'lat': response[0]['lat'], 'lon': response[0]['lon']}
+
+    # --- STAGE 2: NOMINATIM ---
+    # The exact query first; if it misses, the cleaned and first-3-words
+    # queries run concurrently and the first one (in that order) that finds
+    # something wins
+    with metrics.timer('geocode_stage_seconds', stage='nominatim'):
+        try:
+            index, response = geocoder.search_first(queries)
+        except GeocoderUnavailable as e:
+            print(f"⚠️ Address lookup unavailable: {e}")
+            metrics.inc('geocode_results_total', source='unavailable')
+            return {'valid': False, 'unavailable': True}
+    metrics.inc('geocode_results_total', source='nominatim' if len(response) > 0 else 'not_found')
+    if len(response) > 0:
+        if index > 0:
+            print(f"Exact search failed. Matched with fallback query: {queries[index]}")
+        return {'valid': True, 'name': response[0]['display_name'], 'lat': response[0]['lat'], 'lon': response[0]['lon']}
 
     return {'valid': False}
 
 # --- HELPER: GET USER STEP ---
 def get_user_step(chat_id):
-    if chat_id not in user_data:
-        user_data[chat_id] = {'step': 'start'}
-    return user_data[chat_id]['step']
+    # Read-only: unknown chats are 'start' without creating an entry for them
+    state = user_data.get(chat_id)
+    return state['step'] if state else 'start'
+
+
+# One step lookup per update, then a table lookup for the handler
+router = StepRouter(get_user_step)
 
 
 # =======================================================
@@ -167,46 +486,29 @@ def get_user_step(chat_id):
 def show_menu(message):
     chat_id = message.chat.id
     
-    # Reset/Initialize user state
-    user_data[chat_id] = {
-        'step': 'selecting_food',
-        'order_items': [],  # List to store multiple food items
-        'total_food_price': 0.0
-    }
+    # Reset/Initialize user state (cart = item number -> quantity, totals in sen)
+    user_data[chat_id] = {'step': 'selecting_food', **menu.new_cart()}
     
-    # Build the Menu Text
-    text = "🍛 *NASI KANDAR BISTROO MENU* 🍛\n\nTo order, just *reply with the number*:\n\n"
-    for key, item in MENU_ITEMS.items():
-        text += f"*{key}.* {item['name']} - {item['price']}\n"
-    
-    bot.send_message(chat_id, text, parse_mode="Markdown")
+    bot.send_message(chat_id, MENU_TEXT, parse_mode="Markdown")
 
 
 # 2. STEP: SELECT FOOD
-@bot.message_handler(func=lambda msg: get_user_step(msg.chat.id) in ['selecting_food', 'adding_more_food'])
+@router.on(['selecting_food', 'adding_more_food'])
 def handle_food_selection(message):
     chat_id = message.chat.id
     selection = message.text.strip()
     
-    if selection in MENU_ITEMS:
-        selected_item = MENU_ITEMS[selection]
-        selected_food = selected_item['name']
-        food_price = float(selected_item['price'].replace('RM ', ''))
+    if selection in menu:
+        selected_food = menu.name(selection)
         
         # Add item to order
-        user_data[chat_id]['order_items'].append({
-            'name': selected_food,
-            'price': food_price,
-            'quantity': 1
-        })
-        user_data[chat_id]['total_food_price'] += food_price
+        state = user_data[chat_id]
+        menu.add_to_cart(state, selection)
         
         # Show current order summary
-        current_order = user_data[chat_id]['order_items']
-        order_summary = "🛒 *YOUR CURRENT ORDER*\n"
-        for i, item in enumerate(current_order, 1):
-            order_summary += f"{i}. {item['name']} - RM {item['price']:.2f}\n"
-        order_summary += f"\n💰 *Food Total: RM {user_data[chat_id]['total_food_price']:.2f}*"
+        order_summary = (f"🛒 *YOUR CURRENT ORDER*\n"
+                         f"{menu.cart_text(state)}\n"
+                         f"\n💰 *Food Total: {format_rm(state['food_sen'])}*")
         
         # Ask if they want to add more items
         markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
@@ -224,7 +526,7 @@ def handle_food_selection(message):
 
 
 # 2.5 STEP: CONFIRM ADDING MORE ITEMS
-@bot.message_handler(func=lambda msg: get_user_step(msg.chat.id) == 'confirming_more_items')
+@router.on(['confirming_more_items'])
 def handle_more_items_confirmation(message):
     chat_id = message.chat.id
     choice = message.text
@@ -233,16 +535,12 @@ def handle_more_items_confirmation(message):
         # Show menu again for additional selections
         user_data[chat_id]['step'] = 'adding_more_food'
         
-        text = "🍛 *ADD MORE ITEMS TO YOUR ORDER* 🍛\n\nReply with the number to add:\n\n"
-        for key, item in MENU_ITEMS.items():
-            text += f"*{key}.* {item['name']} - {item['price']}\n"
-        
-        # Show current order
-        current_order = user_data[chat_id]['order_items']
-        text += f"\n🛒 *Current Order:*\n"
-        for i, item in enumerate(current_order, 1):
-            text += f"{i}. {item['name']} - RM {item['price']:.2f}\n"
-        text += f"💰 *Food Total: RM {user_data[chat_id]['total_food_price']:.2f}*"
+        # Show current order under the pre-rendered menu
+        state = user_data[chat_id]
+        text = (f"{ADD_MORE_TEXT}"
+                f"\n🛒 *Current Order:*\n"
+                f"{menu.cart_text(state)}\n"
+                f"💰 *Food Total: {format_rm(state['food_sen'])}*")
         
         bot.send_message(chat_id, text, parse_mode="Markdown")
         
@@ -262,7 +560,7 @@ def handle_more_items_confirmation(message):
 
 
 # 3. STEP: GET ADDRESS (With REAL Validation)
-@bot.message_handler(func=lambda msg: get_user_step(msg.chat.id) == 'providing_address')
+@router.on(['providing_address'])
 def handle_address(message):
     chat_id = message.chat.id
     address_input = message.text.strip()
@@ -278,23 +576,26 @@ def handle_address(message):
     map_result = validate_address_osm(address_input)
     
     if map_result['valid']:
-        # 2. SAVE THE REAL DATA
+        # 2. PRICE DELIVERY FROM THE NEAREST OUTLET (real distance to the geocoded point)
+        quote = delivery_zones.quote(map_result['lat'], map_result['lon'])
+        if not quote.serviceable:
+            delivery_not_possible(chat_id, quote)
+            return
+        dist = round(quote.distance_km, 1)
+        charge = quote.fee_sen
+
+        # 3. SAVE THE REAL DATA
         user_data[chat_id]['address'] = map_result['name']
         
-        # (Optional) Calculate REAL delivery charge based on random logic or real coordinates
-        # For now, we simulate distance but ONLY if address is valid
-        import random
-        dist = round(random.uniform(1.0, 15.0), 1) 
-        charge = round(dist * 0.80 + 3.00, 2) # RM0.80 per km + RM3 base fee
-        
         # Get food price for total calculation
-        food_price = user_data[chat_id]['total_food_price']
+        food_price = user_data[chat_id]['food_sen']
         
         total_amount = food_price + charge
         
         user_data[chat_id]['step'] = 'choosing_payment'
-        user_data[chat_id]['delivery_charge'] = charge
+        user_data[chat_id]['delivery_sen'] = charge
         user_data[chat_id]['distance_km'] = dist
+        user_data[chat_id]['outlet'] = quote.outlet['name']
         
         markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
         markup.add('💵 Cash on Delivery', '📲 QR Pay')
@@ -302,16 +603,22 @@ def handle_address(message):
         bot.send_message(chat_id, 
                          f"✅ **Address Found!**\n_{map_result['name']}_\n\n"
                          f"📏 Distance: {dist}km\n"
-                         f"🛵 Delivery Fee: RM {charge:.2f}\n\n"
+                         f"🛵 Delivery Fee: {format_rm(charge)}\n\n"
                          f"💰 **ORDER SUMMARY**\n"
                          f"🍛 *Food Items:*\n"
-                         + "\n".join([f"• {item['name']}: RM {item['price']:.2f}" for item in user_data[chat_id]['order_items']]) + f"\n"
-                         f"🚚 Delivery: RM {charge:.2f}\n"
-                         f"💵 **TOTAL: RM {total_amount:.2f}**\n\n"
+                         f"{menu.cart_text(user_data[chat_id], 'bullets')}\n"
+                         f"🚚 Delivery: {format_rm(charge)}\n"
+                         f"💵 **TOTAL: {format_rm(total_amount)}**\n\n"
                          f"How would you like to pay?", 
                          parse_mode="Markdown", reply_markup=markup)
+    elif map_result.get('unavailable'):
+        # The map service timed out or failed: not the customer's fault, keep the step
+        bot.reply_to(message,
+                     "⚠️ **Map Service Busy**\n\n"
+                     "We couldn't reach the map service just now.\n"
+                     "Please send your address again in a moment, or share your location pin.")
     else:
-        # 3. REJECT INVALID ADDRESS
+        # 4. REJECT INVALID ADDRESS
         bot.reply_to(message, 
                      "❌ **Address Not Found**\n\n"
                      "We couldn't find that location on the map in Malaysia.\n"
@@ -321,7 +628,7 @@ def handle_address(message):
 
 # --- 3b. NEW HANDLER: RECEIVE GPS LOCATION PIN ---
 # This allows users to share their live location or pin instead of typing
-@bot.message_handler(content_types=['location'], func=lambda msg: get_user_step(msg.chat.id) == 'providing_address')
+@router.on(['providing_address'], content_types=['location'])
 def handle_location_pin(message):
     chat_id = message.chat.id
     lat = message.location.latitude
@@ -329,50 +636,31 @@ def handle_location_pin(message):
     
     bot.send_message(chat_id, "📍 Processing your location...")
     
-    # --- HELPER: Calculate Distance (Haversine Formula) ---
-    def calculate_distance(lat1, lon1, lat2, lon2):
-        from math import radians, sin, cos, sqrt, atan2
-        R = 6371.0  # Earth radius in kilometers
-        dlat = radians(lat2 - lat1)
-        dlon = radians(lon2 - lon1)
-        a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        return R * c
-
     # 1. Reverse Geocode (Get address from Coordinates)
     # We ask OSM: "What address is at these coordinates?"
-    url = "https://nominatim.openstreetmap.org/reverse"
-    headers = {'User-Agent': 'NasiKandarBot/1.0'}
-    params = {'lat': lat, 'lon': lon, 'format': 'json'}
-    
     try:
-        response = requests.get(url, params=params, headers=headers).json()
+        response = reverse_geocode(lat, lon)
         address_name = response.get('display_name', f"GPS: {lat}, {lon}")
         
-        # 2. Calculate distance from restaurant (KL City Centre)
-        restaurant_lat, restaurant_lng = 3.1390, 101.6869
-        distance_km = calculate_distance(restaurant_lat, restaurant_lng, lat, lon)
-        
-        # 3. Calculate delivery charge
-        delivery_charge = 2.00 + (distance_km * 0.50)
+        # 2. Nearest outlet that serves this point, its distance and delivery charge
+        quote = delivery_zones.quote(lat, lon)
+        distance_km = quote.distance_km
+        delivery_charge = quote.fee_sen
         
-        # 4. Check if within delivery range
-        if distance_km > 50:
-            bot.send_message(chat_id, 
-                           f"❌ **Too Far for Delivery**\n\n"
-                           f"Your location is {distance_km:.1f}km away.\n"
-                           f"Maximum delivery distance is 50km.\n\n"
-                           f"Please provide a different address or contact us directly.")
+        # 3. Check if within delivery range / service area
+        if not quote.serviceable:
+            delivery_not_possible(chat_id, quote)
             return
         
-        # 5. Save Data
+        # 4. Save Data
         user_data[chat_id]['address'] = address_name
-        user_data[chat_id]['delivery_charge'] = delivery_charge
+        user_data[chat_id]['delivery_sen'] = delivery_charge
         user_data[chat_id]['distance_km'] = distance_km
+        user_data[chat_id]['outlet'] = quote.outlet['name']
         user_data[chat_id]['step'] = 'choosing_payment'
         
         # Get food price for total calculation
-        food_price = user_data[chat_id]['total_food_price']
+        food_price = user_data[chat_id]['food_sen']
         
         total_amount = food_price + delivery_charge
         
@@ -383,12 +671,12 @@ def handle_location_pin(message):
         bot.send_message(chat_id, 
                          f"📍 **Location Received!**\n_{address_name}_\n\n"
                          f"📏 Distance: {distance_km:.1f}km\n"
-                         f"🛵 Delivery Fee: RM {delivery_charge:.2f}\n\n"
+                         f"🛵 Delivery Fee: {format_rm(delivery_charge)}\n\n"
                          f"💰 **ORDER SUMMARY**\n"
                          f"🍛 *Food Items:*\n"
-                         + "\n".join([f"• {item['name']}: RM {item['price']:.2f}" for item in user_data[chat_id]['order_items']]) + f"\n"
-                         f"🚚 Delivery: RM {delivery_charge:.2f}\n"
-                         f"💵 **TOTAL: RM {total_amount:.2f}**\n\n"
+                         f"{menu.cart_text(user_data[chat_id], 'bullets')}\n"
+                         f"🚚 Delivery: {format_rm(delivery_charge)}\n"
+                         f"💵 **TOTAL: {format_rm(total_amount)}**\n\n"
                          f"How would you like to pay?", 
                          parse_mode="Markdown", reply_markup=markup)
                          
@@ -398,8 +686,57 @@ def handle_location_pin(message):
                         "⚠️ Error reading location. Please type your address manually instead.")
 
 
+# --- HELPER: SEND PAYMENT QR (upload once, then reuse Telegram's file_id) ---
+qr_file_ids = FileIdCache(QR_FILE_ID_CACHE or None)
+amount_qrs = AmountQRCache(maxsize=64)
+
+
+def send_static_qr(chat_id, caption):
+    if not os.path.exists(QR_IMAGE_PATH):
+        raise FileNotFoundError(f"QR image not found at {QR_IMAGE_PATH}")
+
+    key = file_key(QR_IMAGE_PATH)
+    file_id = qr_file_ids.get(key)
+    if file_id:
+        try:
+            bot.send_photo(chat_id, file_id,
+                           caption=caption,
+                           parse_mode="Markdown",
+                           reply_markup=types.ReplyKeyboardRemove())
+            return
+        except Exception as e:
+            # Stale or revoked id: forget it and upload again below
+            print(f"Cached QR file_id failed, re-uploading: {e}")
+            qr_file_ids.discard(key)
+
+    with open(QR_IMAGE_PATH, 'rb') as qr_file:
+        qr_data = qr_file.read()
+
+    # Send photo with timeout handling
+    sent = bot.send_photo(chat_id, qr_data,
+                          caption=caption,
+                          parse_mode="Markdown",
+                          reply_markup=types.ReplyKeyboardRemove(),
+                          timeout=30)  # 30 second timeout
+    qr_file_ids.set(key, sent_file_id(sent))
+
+
+def send_amount_qr(chat_id, caption, payment_text):
+    photo = amount_qrs.photo(payment_text)
+    try:
+        sent = bot.send_photo(chat_id, photo,
+                              caption=caption,
+                              parse_mode="Markdown",
+                              reply_markup=types.ReplyKeyboardRemove(),
+                              timeout=30)
+    except Exception:
+        amount_qrs.forget(payment_text)
+        raise
+    amount_qrs.remember(payment_text, sent_file_id(sent))
+
+
 # 4. STEP: CHOOSE PAYMENT METHOD
-@bot.message_handler(func=lambda msg: get_user_step(msg.chat.id) == 'choosing_payment')
+@router.on(['choosing_payment'])
 def handle_payment_choice(message):
     chat_id = message.chat.id
     choice = message.text
@@ -409,54 +746,36 @@ def handle_payment_choice(message):
     
     elif choice == '📲 QR Pay':
         user_data[chat_id]['step'] = 'uploading_proof'
+        # Identifies this payment, so a receipt reused on a later order can be told apart
+        user_data[chat_id]['order_id'] = f"{chat_id}-{int(time.time() * 1000)}"
         
         # Calculate total amount for QR payment
-        total_amount = user_data[chat_id]['total_food_price'] + user_data[chat_id].get('delivery_charge', 5.00)
-        
-        # Send the static QR code image
-        qr_image_path = r"c:\Users\Rafid Mahdi\nasi-kandar-bot\images\QR code.png"
+        total_sen = user_data[chat_id]['food_sen'] + user_data[chat_id].get('delivery_sen', DEFAULT_DELIVERY_SEN)
+        total_amount = format_rm(total_sen)
         
-        caption = f"📲 *Scan DuitNow to Pay RM {total_amount:.2f}*\n\nPlease make payment and *send the receipt (photo)* here."
+        caption = f"📲 *Scan DuitNow to Pay {total_amount}*\n\nPlease make payment and *send the receipt (photo)* here."
         
         try:
-            # Check if file exists first
-            import os
-            if not os.path.exists(qr_image_path):
-                raise FileNotFoundError(f"QR image not found at {qr_image_path}")
-            
-            # Read file with explicit encoding handling
-            with open(qr_image_path, 'rb') as qr_file:
-                qr_data = qr_file.read()
-            
-            # Send photo with timeout handling
-            bot.send_photo(chat_id, qr_data,
-                           caption=caption,
-                           parse_mode="Markdown",
-                           reply_markup=types.ReplyKeyboardRemove(),
-                           timeout=30)  # 30 second timeout
+            # Send the static QR code image (by cached file_id after the first upload)
+            send_static_qr(chat_id, caption)
             
         except FileNotFoundError as e:
             print(f"QR image file not found: {e}")
             # Fallback: generate dynamic QR if static image not found
-            payment_text = f'DuitNow%20to%20Nasi%20Kandar%20RM{total_amount:.2f}'
-            qr_url = f"https://chart.googleapis.com/chart?cht=qr&chs=400x400&chl={payment_text}"
+            payment_text = f"DuitNow to Nasi Kandar {total_amount.replace(' ', '')}"
             try:
-                bot.send_photo(chat_id, qr_url,
-                               caption=caption,
-                               parse_mode="Markdown",
-                               reply_markup=types.ReplyKeyboardRemove(),
-                               timeout=30)
+                send_amount_qr(chat_id, caption, payment_text)
             except Exception as e2:
                 print(f"Dynamic QR also failed: {e2}")
                 bot.send_message(chat_id,
-                                 f"⚠️ QR code generation failed. Please make payment of RM {total_amount:.2f} and send receipt photo.",
+                                 f"⚠️ QR code generation failed. Please make payment of {total_amount} and send receipt photo.",
                                  reply_markup=types.ReplyKeyboardRemove())
                                  
         except Exception as e:
             print(f"Error sending QR image: {e}")
             # Try sending as document instead of photo
             try:
-                with open(qr_image_path, 'rb') as qr_file:
+                with open(QR_IMAGE_PATH, 'rb') as qr_file:
                     bot.send_document(chat_id, qr_file,
                                       caption=caption,
                                       reply_markup=types.ReplyKeyboardRemove(),
@@ -464,7 +783,7 @@ def handle_payment_choice(message):
             except Exception as e2:
                 print(f"Document send also failed: {e2}")
                 bot.send_message(chat_id,
-                                 f"⚠️ Error loading QR code. Please make payment of RM {total_amount:.2f} and send receipt photo.",
+                                 f"⚠️ Error loading QR code. Please make payment of {total_amount} and send receipt photo.",
                                  reply_markup=types.ReplyKeyboardRemove())
         
     else:
@@ -472,58 +791,233 @@ def handle_payment_choice(message):
 
 
 # 5. STEP: UPLOAD RECEIPT
-@bot.message_handler(content_types=['photo'], func=lambda msg: get_user_step(msg.chat.id) == 'uploading_proof')
+@router.on(['uploading_proof'], content_types=['photo'])
 def handle_receipt(message):
     chat_id = message.chat.id
-    bot.reply_to(message, "🤖 AI is analyzing your receipt... Please wait...")
-    try:
-        # Download image from Telegram
-        file_info = bot.get_file(message.photo[-1].file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
+    state = user_data[chat_id]
+    attempts = state.get('receipt_attempts', 0)
+    # First uploads are checked before re-uploads, so one customer resending can't starve others
+    job = ReceiptJob(chat_id, state.get('order_id'), message.photo[-1].file_id,
+                     priority=attempts, timeout=RECEIPT_DEADLINE_SECONDS)
+
+    if not receipt_jobs.submit(job):
+        # Too many receipts waiting: don't stall the bot, hand this one to staff
+        metrics.inc('receipt_jobs_total', outcome='overloaded')
+        hold_for_review(job, 'overloaded', "📥 Receipt received! We're busy right now, so our staff will check it manually.")
+        return
+
+    state['step'] = 'verifying_receipt'
+    state['receipt_attempts'] = attempts + 1
+    if receipt_model.status == 'loading':
+        bot.reply_to(message, "📥 Receipt received! AI is still warming up — we'll message you here once it's checked.")
+    else:
+        bot.reply_to(message, "📥 Receipt received! AI is analyzing it — we'll message you here in a moment.")
+
+
+@router.on(['verifying_receipt'], content_types=['text', 'photo'])
+def handle_while_verifying(message):
+    bot.reply_to(message, "⏳ Still checking your receipt — you'll get a message here as soon as it's done.")
+
+
+@router.on(['awaiting_review'], content_types=['text', 'photo'])
+def handle_while_in_review(message):
+    bot.reply_to(message, "🧾 Your order is on hold until our staff confirm your payment. Type /menu to start a new order.")
+
+
+# --- RECEIPT JOBS (checked in the background, verdict pushed back to the chat) ---
+def process_receipt_job(job):
+    metrics.observe('receipt_job_wait_seconds', time.monotonic() - job.submitted_at)
+    file_info = bot.get_file(job.file_id)
+    with metrics.timer('telegram_download_seconds'):
+        downloaded_file = download_file(file_info.file_path, timeout=max(0.1, job.remaining()))
+
+    # The exact file seen before: no decode, no model
+    digest = image_digest(downloaded_file)
+    cached = verdict_cache.get(digest)
+    duplicate = cached is not None
+    if duplicate:
+        is_valid, paid_order = cached
+        paid, seen_order = is_valid, paid_order
+    else:
+        # Verify locally (pre-filter, then the VQA model) within the job's deadline
+        receipt = ReceiptImage(downloaded_file, max_side=RECEIPT_MAX_SIDE)
+        is_valid, stage, total = check_receipt(receipt, timeout=job.remaining())
+        paid_order = job.order_id
+        if stage is not None:
+            # A near-duplicate (recompressed/resized) of a receipt we've already
+            # processed; look-alike receipts from one bank must also share the total
+            seen = receipt_index.match(dhash(receipt.image), is_valid, total,
+                                       chat_id=job.chat_id, order_id=job.order_id)
+            duplicate = seen is not None
+            if duplicate:
+                paid, seen_order = seen.verdict, seen.order_id
+                if paid:
+                    paid_order = seen.order_id
+        if is_valid is not None:
+            verdict_cache.set(digest, is_valid, paid_order)
+
+    if duplicate:
+        if paid_order != job.order_id and paid and is_valid:
+            # A receipt that already paid for a different order
+            receipt_index.flag_reuse()
+            metrics.inc('receipt_duplicates_total', kind='other_order')
+            print(f"⚠️ Receipt reused: chat {job.chat_id} order {job.order_id} matches order {paid_order}")
+            return finish_receipt_job(job, None, 'reused')
+        metrics.inc('receipt_duplicates_total', kind='same_order' if seen_order == job.order_id else 'other_order_unpaid')
+
+    if is_valid is None:
+        return finish_receipt_job(job, None, 'deadline' if job.remaining() <= 0 else 'unchecked')
+    finish_receipt_job(job, is_valid)
 
-        # Verify locally using transformers pipeline
-        is_valid = verify_receipt_locally(downloaded_file)
 
-        if is_valid:
-            bot.reply_to(message, "✅ Receipt Verified! Payment successful.")
-            complete_order(chat_id, "Paid via QR (Verified)")
+def download_file(file_path, timeout):
+    """bot.download_file, but giving up after `timeout` seconds."""
+    url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(TOKEN, file_path)
+    result = apihelper._get_req_session().get(url, proxies=apihelper.proxy, timeout=timeout)
+    if result.status_code != 200:
+        raise apihelper.ApiHTTPException('Download file', result)
+    return result.content
+
+
+def finish_receipt_job(job, is_valid, reason=None):
+    # Back on the chat's own worker, so the verdict is ordered with the chat's updates
+    chat_executor.submit(job.chat_id, deliver_receipt_verdict, job, is_valid, reason)
+
+
+def deliver_receipt_verdict(job, is_valid, reason=None):
+    chat_id = job.chat_id
+    state = user_data.get(chat_id)
+    if not state or state.get('step') != 'verifying_receipt' or state.get('order_id') != job.order_id:
+        # The customer has moved on (e.g. started over); nothing to deliver
+        metrics.inc('receipt_jobs_total', outcome='stale')
+        return
+
+    if is_valid:
+        metrics.inc('receipt_jobs_total', outcome='verified')
+        bot.send_message(chat_id, "✅ Receipt Verified! Payment successful.")
+        complete_order(chat_id, "Paid via QR (Verified)")
+    elif is_valid is False:
+        metrics.inc('receipt_jobs_total', outcome='rejected')
+        user_data[chat_id]['step'] = 'uploading_proof'
+        bot.send_message(chat_id, "⚠️ The AI could not detect a total amount. Please upload a clearer photo.")
+    else:
+        metrics.inc('receipt_jobs_total', outcome=reason or 'unchecked')
+        if reason == 'reused':
+            hold_for_review(job, reason, "⚠️ This receipt looks like one already used for another order. We will check it manually.")
         else:
-            bot.reply_to(message, "⚠️ The AI could not detect a total amount. Please upload a clearer photo.")
+            hold_for_review(job, reason, "⏳ We couldn't verify your receipt automatically. Our staff will check it manually.")
+
+
+def hold_for_review(job, reason, text):
+    """
+    Unverified payment: the order is not confirmed (no kitchen, no rider) but
+    kept in 'awaiting_review' and queued for staff with its cart and address.
+    """
+    chat_id = job.chat_id
+    state = user_data[chat_id]
+    send_to_manual_review(job, reason, state)
+    state['step'] = 'awaiting_review'
+    bot.send_message(chat_id, f"{text}\n\nYour order is on hold until your payment is confirmed.",
+                     reply_markup=types.ReplyKeyboardRemove())
+
+
+def send_to_manual_review(job, reason, order_details):
+    print(f"🧾 Manual review: chat {job.chat_id} order {job.order_id} ({reason})")
+    if review_queue is None:
+        return
+    delivery_charge = order_details.get('delivery_sen', DEFAULT_DELIVERY_SEN)
+    try:
+        review_queue.append({'ts': time.time(), 'chat_id': job.chat_id, 'order_id': job.order_id,
+                             'file_id': job.file_id, 'reason': reason,
+                             'items': order_items(order_details),
+                             'total_sen': order_details['food_sen'] + delivery_charge,
+                             'address': order_details.get('address')})
     except Exception as e:
-        print(f"Error during receipt handling: {e}")
-        traceback.print_exc()
-        bot.reply_to(message, "⚠️ System error. We will check manually.")
-        complete_order(chat_id, "Manual Check Required")
+        print(f"⚠️ Could not queue receipt for manual review: {e}")
+
+
+def resume_interrupted_receipt(chat_id):
+    # Its job was lost with the previous process; ask for the receipt again
+    state = user_data.get(chat_id)
+    if not state or state.get('step') != 'verifying_receipt':
+        return
+    user_data[chat_id]['step'] = 'uploading_proof'
+    metrics.inc('receipt_jobs_total', outcome='interrupted')
+    bot.send_message(chat_id, "⚠️ We restarted while checking your receipt. Please send the receipt photo again.")
+
+
+verdict_cache = VerdictCache(maxsize=RECEIPT_VERDICT_CACHE,
+                             db_path=RECEIPT_VERDICT_DB or None,
+                             max_age=RECEIPT_DEDUP_MAX_AGE_HOURS * 3600)
+review_queue = None
+if REVIEW_DIR:
+    review_queue = OrderLedger(REVIEW_DIR, name=f"review.shard{shard.index}" if shard is not None else 'review')
+receipt_jobs = ReceiptJobQueue(process_receipt_job,
+                               on_expired=lambda job, reason: finish_receipt_job(job, None, reason),
+                               workers=RECEIPT_JOB_WORKERS,
+                               maxsize=RECEIPT_QUEUE_MAX)
 
 
 # 6. FINAL STEP: ORDER COMPLETION & GPS
 def complete_order(chat_id, payment_method):
     order_details = user_data[chat_id]
     
-    # Build food items summary
-    food_items_text = ""
-    total_food_price = 0.0
-    for item in order_details['order_items']:
-        food_items_text += f"🍛 {item['name']} - RM {item['price']:.2f}\n"
-        total_food_price += item['price']
+    # Build food items summary (cached render of the cart)
+    food_items_text = menu.cart_text(order_details, 'receipt')
     
-    delivery_charge = order_details.get('delivery_charge', 5.00)
-    total_amount = total_food_price + delivery_charge
+    delivery_charge = order_details.get('delivery_sen', DEFAULT_DELIVERY_SEN)
+    total_amount = order_details['food_sen'] + delivery_charge
     
     summary = (f"🧾 *ORDER CONFIRMED*\n"
                f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
-               f"{food_items_text}"
+               f"{food_items_text}\n"
                f"📍 *Addr:* {order_details['address']}\n"
-               f"🚚 *Delivery:* RM {delivery_charge:.2f}\n"
+               f"🚚 *Delivery:* {format_rm(delivery_charge)}\n"
                f"💳 *Type:* {payment_method}\n"
                f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
-               f"💰 *TOTAL: RM {total_amount:.2f}*\n\n"
+               f"💰 *TOTAL: {format_rm(total_amount)}*\n\n"
                f"👨‍🍳 _Kitchen is preparing your food..._")
     
     bot.send_message(chat_id, summary, parse_mode="Markdown", reply_markup=types.ReplyKeyboardRemove())
+    record_order(chat_id, order_details, payment_method, delivery_charge)
     
-    time.sleep(2)
+    # Scheduled rather than slept on, so this worker is free straight away
+    scheduler.call_later(RIDER_PICKUP_DELAY, send_rider_picked_up, chat_id, chat_id=chat_id)
     
+    user_data[chat_id] = {'step': 'start'}
+
+
+def record_order(chat_id, order_details, payment_method, delivery_charge):
+    """
+    Append the completed order to the ledger, with item names and prices as sold.
+    """
+    if order_ledger is None:
+        return
+    try:
+        order_ledger.append({
+            'order_id': order_details.get('order_id') or f"{chat_id}-{int(time.time() * 1000)}",
+            'ts': time.time(),
+            'chat_id': chat_id,
+            'items': order_items(order_details),
+            'food_sen': order_details['food_sen'],
+            'delivery_sen': delivery_charge,
+            'total_sen': order_details['food_sen'] + delivery_charge,
+            'distance_km': order_details.get('distance_km'),
+            'outlet': order_details.get('outlet'),
+            'address': order_details.get('address'),
+            'payment': payment_method,
+        })
+        metrics.inc('orders_total', payment=payment_method)
+    except Exception as e:
+        print(f"⚠️ Could not record order for chat {chat_id}: {e}")
+
+
+def order_items(order_details):
+    return [{'key': key, 'name': menu.name(key), 'qty': qty, 'price_sen': menu.price_sen(key)}
+            for key, qty in order_details['cart'].items()]
+
+
+def send_rider_picked_up(chat_id):
     gps_link = "https://www.google.com/maps/search/?api=1&query=Georgetown,+Penang"
     
     bot.send_message(chat_id, 
@@ -531,12 +1025,10 @@ def complete_order(chat_id, payment_method):
                      f"Your rider *Ali* (PLT 1234) is on the way.\n\n"
                      f"🔴 [Click here to track Driver GPS]({gps_link})", 
                      parse_mode="Markdown")
-    
-    user_data[chat_id] = {'step': 'start'}
 
 
 # Handle random text (only if not in the middle of an order)
-@bot.message_handler(func=lambda msg: True)
+@router.default()
 def echo_all(message):
     # Do not interfere when user is in HF chat mode
     if user_data.get(message.chat.id, {}).get('hf_mode') == 'chat':
@@ -544,5 +1036,110 @@ def echo_all(message):
     if get_user_step(message.chat.id) == 'start':
         bot.reply_to(message, "Hello! Please type 'Hi' or /menu to order food.")
 
-# --- START POLLING ---
-bot.infinity_polling()
\ No newline at end of file
+# --- STEP ROUTER ---
+# Registered last so the menu/greeting handlers above still take precedence
+@bot.message_handler(content_types=router.content_types)
+def route_by_step(message):
+    if not router.dispatch(message):
+        metrics.inc('unrouted_messages_total', content_type=message.content_type)
+
+
+# --- RUNTIME GAUGES (read on every /metrics scrape) ---
+def collect_runtime_gauges():
+    gauges = [
+        ('handler_queue_depth', {}, chat_executor.pending()),
+        ('handler_active_chats', {}, chat_executor.active_chats()),
+        ('handler_errors', {}, chat_executor.errors),
+        ('scheduled_jobs', {}, scheduler.pending()),
+        ('receipt_model_ready', {}, 1 if receipt_model.status == 'ready' else 0),
+    ]
+    if receipt_model.model is not None:
+        gauges.append(('receipt_batch_queue_depth', {}, receipt_model.model.pending()))
+
+    geo = geocoder.stats()
+    for key in ('sent', 'coalesced', 'errors', 'cancelled', 'inflight'):
+        gauges.append(('nominatim_' + key, {}, geo[key]))
+    for key, value in geo['cache'].items():
+        gauges.append(('geocode_cache_' + key, {}, value))
+
+    for key, value in user_data.stats().items():
+        gauges.append(('sessions_' + key, {}, value))
+
+    if prefilter is not None:
+        for outcome, hit in prefilter.stats().items():
+            gauges.append(('receipt_prefilter_hit_rate', {'outcome': outcome}, hit['rate']))
+
+    for key, value in receipt_jobs.stats().items():
+        gauges.append(('receipt_jobs_' + key, {}, value))
+    for key, value in verdict_cache.stats().items():
+        gauges.append(('receipt_verdict_cache_' + key, {}, value))
+    for key, value in receipt_index.stats().items():
+        gauges.append(('receipt_index_' + key, {}, value))
+
+    if order_ledger is not None:
+        for key, value in order_ledger.stats().items():
+            gauges.append(('ledger_' + key, {}, value))
+
+    cart_cache = menu.cache_info()
+    gauges.append(('cart_render_cache_hits', {}, cart_cache.hits))
+    gauges.append(('cart_render_cache_misses', {}, cart_cache.misses))
+
+    for step, timing in router.timings().items():
+        gauges.append(('step_calls', {'step': step}, timing['calls']))
+        gauges.append(('step_seconds_total', {'step': step}, timing['total_s']))
+        gauges.append(('step_seconds_max', {'step': step}, timing['max_s']))
+    return gauges
+
+
+metrics.add_collector(collect_runtime_gauges)
+
+
+# --- START POLLING / WEBHOOK ---
+if METRICS_PORT:
+    start_metrics_server(metrics, METRICS_PORT, host=METRICS_HOST)
+    print(f"📈 Metrics at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+startup.mark('polling')
+if STARTUP_TIMINGS_LOG:
+    # Saved once the model has finished so the record covers the whole cold start
+    def _save_startup_timings():
+        receipt_model.wait()
+        try:
+            startup.save(STARTUP_TIMINGS_LOG, release=RELEASE)
+        except Exception as e:
+            print(f"Could not save startup timings: {e}")
+    threading.Thread(target=_save_startup_timings, daemon=True).start()
+
+# Receipts that were being checked when the bot last stopped (sqlite sessions only)
+interrupted = user_data.chats_in_step('verifying_receipt')
+if interrupted:
+    print(f"🧾 Asking {len(interrupted)} chats to resend receipts interrupted by a restart")
+    for chat_id in interrupted:
+        chat_executor.submit(chat_id, resume_interrupted_receipt, chat_id)
+
+# --- SHUTDOWN ---
+# Write out buffered sessions, orders and review entries. atexit covers a
+# normal exit; forked shard workers skip atexit, so they run this on stop.
+def shutdown():
+    user_data.flush()
+    for ledger in (order_ledger, review_queue):
+        if ledger is not None:
+            ledger.close()
+
+if shard is not None:
+    shard.at_exit(shutdown)
+    print(f"⏱️ Shard {shard.index} serving its chats (AI model: {receipt_model.status})")
+    shard.serve(bot)
+elif BOT_MODE == 'webhook':
+    webhook = WebhookServer(bot, path=WEBHOOK_PATH, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                            secret_token=WEBHOOK_SECRET or None,
+                            max_pending=WEBHOOK_MAX_PENDING, metrics=metrics)
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + webhook.path,
+                        secret_token=WEBHOOK_SECRET or None,
+                        drop_pending_updates=False)
+    print(f"⏱️ Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{webhook.path} (AI model: {receipt_model.status})")
+    webhook.serve_forever()
+else:
+    print(f"⏱️ Polling started (AI model: {receipt_model.status})")
+    bot.infinity_polling()
@@ -0,0 +1,411 @@
+"""
+Offline benchmark / load test for the bot.
+
+Starts local stand-ins for the Telegram Bot API and Nominatim, launches
+app.py against them, and replays scripted customer journeys (menu -> food ->
+address or location pin -> payment -> receipt) at a configurable
+concurrency. Reports p50/p95/p99 latency per handler, throughput and the bot
+process's memory use. Nothing leaves the machine.
+
+Usage:
+    python benchmark.py --customers 200 --concurrency 20
+    python benchmark.py --journeys pin_qr --geo-latency 300 --json bench.json
+"""
+import argparse
+import io
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BENCH_TOKEN = "123456:BENCHMARK"
+
+
+# =======================================================
+#                 FAKE TELEGRAM BOT API
+# =======================================================
+class FakeTelegram:
+    """Holds queued updates for getUpdates and records every message the bot sends."""
+
+    def __init__(self, receipt_bytes):
+        self.receipt_bytes = receipt_bytes
+        self.updates = []
+        self.sent = defaultdict(list)  # chat_id -> [(time, text)]
+        self.cond = threading.Condition()
+        self.polled = threading.Event()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.calls = defaultdict(int)
+
+    # --- driver side ---
+    def push(self, chat_id, **content):
+        message = {
+            'message_id': next(self.message_ids),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f"Customer{chat_id}"},
+            'chat': {'id': chat_id, 'type': 'private'},
+            'date': int(time.time()),
+        }
+        message.update(content)
+        with self.cond:
+            self.updates.append({'update_id': next(self.update_ids), 'message': message})
+            self.cond.notify_all()
+
+    def mark(self, chat_id):
+        with self.cond:
+            return len(self.sent[chat_id])
+
+    def wait_for(self, chat_id, since, markers, timeout):
+        """Wait for a bot message to `chat_id` (after index `since`) containing any marker."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                for sent_at, text in self.sent[chat_id][since:]:
+                    if any(marker in text for marker in markers):
+                        return sent_at
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    # --- bot side ---
+    def get_updates(self, offset, timeout):
+        self.polled.set()
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                # Updates below the offset are acknowledged and can be dropped
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+                if self.updates or time.monotonic() >= deadline:
+                    return list(self.updates[:100])
+                self.cond.wait(deadline - time.monotonic())
+
+    def record(self, method, params):
+        chat_id = int(params.get('chat_id', 0))
+        text = params.get('text') or params.get('caption') or ''
+        with self.cond:
+            self.calls[method] += 1
+            self.sent[chat_id].append((time.perf_counter(), text))
+            self.cond.notify_all()
+        result = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text,
+        }
+        if method == 'sendPhoto':
+            result['photo'] = [{'file_id': 'bench-photo', 'file_unique_id': 'bench-photo', 'width': 400, 'height': 400}]
+        elif method == 'sendDocument':
+            result['document'] = {'file_id': 'bench-doc', 'file_unique_id': 'bench-doc'}
+        return result
+
+
+def telegram_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _params(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            content_type = self.headers.get('Content-Type', '')
+            if body and 'application/x-www-form-urlencoded' in content_type:
+                params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+            elif body and 'application/json' in content_type:
+                params.update(json.loads(body))
+            return url.path, params
+
+        def _reply(self, payload, content_type='application/json'):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.do_POST()
+
+        def do_POST(self):
+            path, params = self._params()
+            if path.startswith('/file/'):
+                return self._reply(fake.receipt_bytes, 'image/jpeg')
+
+            method = path.rsplit('/', 1)[-1]
+            if method == 'getUpdates':
+                updates = fake.get_updates(int(params.get('offset', 0)), float(params.get('timeout', 0)))
+                return self._reply({'ok': True, 'result': updates})
+            if method == 'getMe':
+                return self._reply({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}})
+            if method == 'getFile':
+                return self._reply({'ok': True, 'result': {'file_id': params.get('file_id'), 'file_unique_id': 'r',
+                                                           'file_size': len(fake.receipt_bytes), 'file_path': 'photos/receipt.jpg'}})
+            if method.startswith('send'):
+                return self._reply({'ok': True, 'result': fake.record(method, params)})
+            return self._reply({'ok': True, 'result': True})
+
+    return Handler
+
+
+# =======================================================
+#                    FAKE NOMINATIM
+# =======================================================
+def nominatim_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            time.sleep(latency)
+            if url.path.endswith('/reverse'):
+                payload = {'display_name': f"Jalan Bench, {params.get('lat')}, {params.get('lon')}, Kuala Lumpur, Malaysia"}
+            elif 'nowhere' in params.get('q', '').lower():
+                payload = []
+            else:
+                payload = [{'display_name': f"{params.get('q')}, Kuala Lumpur, Malaysia", 'lat': '3.1466', 'lon': '101.6958'}]
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def start_server(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# =======================================================
+#                   CUSTOMER JOURNEYS
+# =======================================================
+# Each step: (handler it exercises, message content, markers of the reply that completes it)
+def text(value):
+    return {'text': value}
+
+
+MENU = ('show_menu', text('/menu'), ('MENU',))
+PICK = ('handle_food_selection', text('1'), ('Added',))
+MORE = ('handle_more_items_confirmation', text('✅ Yes, add more items'), ('ADD MORE ITEMS',))
+PICK_AGAIN = ('handle_food_selection', text('5'), ('Added',))
+DELIVERY = ('handle_more_items_confirmation', text('🚚 No, proceed to delivery'), ('Delivery Address',))
+ADDRESS = ('handle_address', text('Menara Maybank, Jalan Tun Perak, Kuala Lumpur'), ('Address Found', 'Address Not Found', 'Map Service Busy'))
+PIN = ('handle_location_pin', {'location': {'latitude': 3.1466, 'longitude': 101.6958}}, ('Location Received', 'Too Far', 'Error reading location'))
+CASH = ('handle_payment_choice', text('💵 Cash on Delivery'), ('ORDER CONFIRMED',))
+QR = ('handle_payment_choice', text('📲 QR Pay'), ('Scan DuitNow', 'Please make payment'))
+RECEIPT = ('handle_receipt', {'photo': [{'file_id': 'receipt', 'file_unique_id': 'receipt', 'width': 600, 'height': 900}]},
+           ('ORDER CONFIRMED', 'clearer photo', 'on hold'))
+
+JOURNEYS = {
+    'address_cash': [MENU, PICK, MORE, PICK_AGAIN, DELIVERY, ADDRESS, CASH],
+    'address_qr': [MENU, PICK, DELIVERY, ADDRESS, QR, RECEIPT],
+    'pin_qr': [MENU, PICK, MORE, PICK_AGAIN, DELIVERY, PIN, QR, RECEIPT],
+}
+
+
+def make_receipt_image():
+    """A small synthetic receipt-like JPEG (white page with rows of dark 'text')."""
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (600, 900), 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(60, 840, 36):
+        draw.rectangle([40, y, 40 + (y * 7) % 480 + 60, y + 14], fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    # Nearest-rank percentile
+    k = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[k]
+
+
+class MemorySampler(threading.Thread):
+    """Samples a process's resident memory (Linux /proc) while the benchmark runs."""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self.last_kb = 0
+        self.stopped = threading.Event()
+
+    def rss_kb(self):
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.last_kb = self.rss_kb()
+            self.peak_kb = max(self.peak_kb, self.last_kb)
+
+
+def run_customer(fake, chat_id, journey, latencies, failures, timeout):
+    for handler, content, markers in JOURNEYS[journey]:
+        since = fake.mark(chat_id)
+        started = time.perf_counter()
+        fake.push(chat_id, **content)
+        done_at = fake.wait_for(chat_id, since, markers, timeout)
+        if done_at is None:
+            failures[handler] += 1
+            return False
+        latencies[handler].append(done_at - started)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test with fake Telegram and Nominatim servers.")
+    parser.add_argument('--customers', type=int, default=100, help="journeys to run in total")
+    parser.add_argument('--concurrency', type=int, default=10, help="customers active at the same time")
+    parser.add_argument('--journeys', default=','.join(JOURNEYS), help="comma-separated journey names to mix")
+    parser.add_argument('--geo-latency', type=float, default=150, help="fake Nominatim latency (ms)")
+    parser.add_argument('--step-timeout', type=float, default=120, help="max seconds to wait for one reply")
+    parser.add_argument('--startup-timeout', type=float, default=300, help="max seconds to wait for the bot to poll")
+    parser.add_argument('--receipt', help="receipt image to serve for downloads (default: synthetic)")
+    parser.add_argument('--json', help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    journeys = [j.strip() for j in args.journeys.split(',') if j.strip()]
+    for journey in journeys:
+        if journey not in JOURNEYS:
+            parser.error(f"unknown journey {journey!r} (choose from {', '.join(JOURNEYS)})")
+
+    if args.receipt:
+        with open(args.receipt, 'rb') as f:
+            receipt_bytes = f.read()
+    else:
+        receipt_bytes = make_receipt_image()
+
+    fake = FakeTelegram(receipt_bytes)
+    telegram = start_server(telegram_handler(fake))
+    nominatim = start_server(nominatim_handler(args.geo_latency / 1000.0))
+
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_TOKEN': BENCH_TOKEN,
+        'TELEGRAM_API_URL': f"http://127.0.0.1:{telegram.server_port}",
+        'NOMINATIM_URL': f"http://127.0.0.1:{nominatim.server_port}",
+    })
+    env.setdefault('NOMINATIM_RATE', '0')       # no politeness limit against the stand-in
+    env.setdefault('GEOCODE_CACHE_DB', '')      # don't mix benchmark answers into the real cache
+    env.setdefault('SESSION_BACKEND', 'memory')
+    env.setdefault('QR_FILE_ID_CACHE', '')
+    env.setdefault('LEDGER_DIR', '')            # benchmark orders stay out of the real ledger
+    env.setdefault('REVIEW_DIR', '')            # ...and out of the manual review queue
+    env.setdefault('RECEIPT_VERDICT_DB', '')    # ...and its verdicts out of the shared cache
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    print(f"⏳ Starting bot against fake Telegram :{telegram.server_port} and Nominatim :{nominatim.server_port}...")
+    t0 = time.perf_counter()
+    bot = subprocess.Popen([sys.executable, app_path], env=env)
+    try:
+        if not fake.polled.wait(args.startup_timeout):
+            print("❌ Bot never started polling.")
+            return 1
+        startup_s = time.perf_counter() - t0
+        print(f"✅ Bot polling after {startup_s:.2f}s — running {args.customers} journeys at concurrency {args.concurrency}")
+
+        sampler = MemorySampler(bot.pid)
+        sampler.start()
+        latencies = defaultdict(list)
+        failures = defaultdict(int)
+        completed = [0]
+        counter = itertools.count()
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                n = next(counter)
+                if n >= args.customers:
+                    return
+                ok = run_customer(fake, 10_000 + n, journeys[n % len(journeys)], latencies, failures, args.step_timeout)
+                if ok:
+                    with lock:
+                        completed[0] += 1
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, args.concurrency))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        sampler.stopped.set()
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+
+    updates = sum(len(v) for v in latencies.values())
+    report = {
+        'customers': args.customers,
+        'concurrency': args.concurrency,
+        'journeys': journeys,
+        'startup_s': round(startup_s, 3),
+        'elapsed_s': round(elapsed, 3),
+        'completed': completed[0],
+        'journeys_per_s': round(completed[0] / elapsed, 2) if elapsed else 0.0,
+        'updates_per_s': round(updates / elapsed, 2) if elapsed else 0.0,
+        'rss_peak_mb': round(sampler.peak_kb / 1024, 1),
+        'rss_end_mb': round(sampler.last_kb / 1024, 1),
+        'telegram_calls': dict(fake.calls),
+        'handlers': {
+            handler: {
+                'count': len(values),
+                'failures': failures.get(handler, 0),
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+                'max_ms': round(max(values) * 1000, 1) if values else 0.0,
+            }
+            for handler, values in sorted(latencies.items())
+        },
+    }
+
+    print(f"\n📊 {report['completed']}/{args.customers} journeys in {elapsed:.2f}s "
+          f"({report['journeys_per_s']} journeys/s, {report['updates_per_s']} updates/s)")
+    print(f"🧠 Bot RSS: peak {report['rss_peak_mb']} MB, end {report['rss_end_mb']} MB")
+    print(f"\n{'handler':34} {'count':>6} {'fail':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for handler, row in report['handlers'].items():
+        print(f"{handler:34} {row['count']:>6} {row['failures']:>5} {row['p50_ms']:>9} "
+              f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+    for handler, count in failures.items():
+        if handler not in report['handlers']:
+            print(f"{handler:34} {0:>6} {count:>5}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+    return 0 if completed[0] == args.customers else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
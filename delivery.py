@@ -0,0 +1,204 @@
+"""
+Delivery zones: nearest outlet, real distance and delivery fee.
+
+Outlets come from a JSON file:
+
+    {"outlets": [{"name": "KL City Centre", "lat": 3.1390, "lon": 101.6869,
+                  "max_km": 50, "base_fee": 2.00, "per_km": 0.50,
+                  "area": [[lat, lon], ...]}]}
+
+`area` (optional) is the outlet's service-area polygon. Distances to every
+outlet are computed at once with NumPy (Haversine). Service areas are
+rasterized at load into a grid of `grid_deg` cells marked inside or edge, so
+a point only needs the exact point-in-polygon test in cells the boundary
+crosses. `quote_many` prices many points (e.g. pending orders after a tariff
+change) in one vectorized pass:
+
+    python delivery.py quote outlets.json points.csv   # CSV with lat,lon columns
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+INSIDE, EDGE = 1, 2
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distance (km) from each point in (lat, lon) to each of (lats, lons); arrays broadcast."""
+    lat, lon, lats, lons = (np.radians(np.asarray(x, dtype=float)) for x in (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def point_in_polygon(lat, lon, polygon):
+    """Ray casting; `polygon` is a list of (lat, lon) vertices."""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            if lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+        j = i
+    return inside
+
+
+def _segment_hits_box(p, q, box):
+    """Liang-Barsky: does segment p-q touch box (min_lat, min_lon, max_lat, max_lon)?"""
+    t0, t1 = 0.0, 1.0
+    d = (q[0] - p[0], q[1] - p[1])
+    for axis in (0, 1):
+        for edge, sign in ((box[axis], -1), (box[axis + 2], 1)):
+            num = sign * (edge - p[axis])
+            den = sign * d[axis]
+            if den == 0:
+                if num < 0:
+                    return False
+                continue
+            t = num / den
+            if den > 0:
+                t1 = min(t1, t)
+            else:
+                t0 = max(t0, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+def rasterize(polygon, grid_deg):
+    """{(row, col): INSIDE | EDGE} for every grid cell the polygon covers."""
+    cells = {}
+    n = len(polygon)
+    for i in range(n):
+        p, q = polygon[i], polygon[(i + 1) % n]
+        rows = range(math.floor(min(p[0], q[0]) / grid_deg), math.floor(max(p[0], q[0]) / grid_deg) + 1)
+        cols = range(math.floor(min(p[1], q[1]) / grid_deg), math.floor(max(p[1], q[1]) / grid_deg) + 1)
+        for row in rows:
+            for col in cols:
+                box = (row * grid_deg, col * grid_deg, (row + 1) * grid_deg, (col + 1) * grid_deg)
+                if _segment_hits_box(p, q, box):
+                    cells[(row, col)] = EDGE
+
+    # Cells the boundary doesn't cross are wholly inside or outside: test their centres
+    lats = [v[0] for v in polygon]
+    lons = [v[1] for v in polygon]
+    for row in range(math.floor(min(lats) / grid_deg), math.floor(max(lats) / grid_deg) + 1):
+        for col in range(math.floor(min(lons) / grid_deg), math.floor(max(lons) / grid_deg) + 1):
+            if (row, col) not in cells and point_in_polygon((row + 0.5) * grid_deg, (col + 0.5) * grid_deg, polygon):
+                cells[(row, col)] = INSIDE
+    return cells
+
+
+class Quote:
+    __slots__ = ('outlet', 'distance_km', 'fee_sen', 'serviceable', 'reason')
+
+    def __init__(self, outlet, distance_km, fee_sen, serviceable, reason=None):
+        self.outlet = outlet
+        self.distance_km = distance_km
+        self.fee_sen = fee_sen
+        self.serviceable = serviceable
+        self.reason = reason  # 'too_far' or 'outside_area' when not serviceable
+
+
+class DeliveryZones:
+    def __init__(self, outlets, grid_deg=0.01):
+        if not outlets:
+            raise ValueError("At least one outlet is required")
+        self.outlets = [dict(o) for o in outlets]
+        self.names = [o['name'] for o in self.outlets]
+        self.grid_deg = grid_deg
+        self.lats = np.array([o['lat'] for o in self.outlets], dtype=float)
+        self.lons = np.array([o['lon'] for o in self.outlets], dtype=float)
+        self.max_km = np.array([o.get('max_km', 50) for o in self.outlets], dtype=float)
+        self.base_sen = np.array([round(o.get('base_fee', 2.00) * 100) for o in self.outlets], dtype=float)
+        self.per_km_sen = np.array([o.get('per_km', 0.50) * 100 for o in self.outlets], dtype=float)
+        self.areas = [[tuple(v) for v in o['area']] if o.get('area') else None for o in self.outlets]
+        self.grids = [rasterize(area, grid_deg) if area else None for area in self.areas]
+
+    @classmethod
+    def from_file(cls, path, grid_deg=0.01):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f)['outlets'], grid_deg=grid_deg)
+
+    def __len__(self):
+        return len(self.outlets)
+
+    def in_areas(self, lat, lon):
+        """Boolean mask: which outlets' service areas contain the point (no area = everywhere)."""
+        cell = (math.floor(lat / self.grid_deg), math.floor(lon / self.grid_deg))
+        mask = np.ones(len(self.outlets), dtype=bool)
+        for i, grid in enumerate(self.grids):
+            if grid is None:
+                continue
+            state = grid.get(cell)
+            mask[i] = state == INSIDE or (state == EDGE and point_in_polygon(lat, lon, self.areas[i]))
+        return mask
+
+    def quote_many(self, lats, lons):
+        """
+        Vectorized quotes for N points: (outlet_index, distance_km, fee_sen, serviceable)
+        arrays of length N. Unserviceable points get their nearest outlet overall.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        distances = haversine_km(lats[:, None], lons[:, None], self.lats[None, :], self.lons[None, :])
+        eligible = np.array([self.in_areas(lat, lon) for lat, lon in zip(lats, lons)],
+                            dtype=bool).reshape(len(lats), len(self.outlets))
+        eligible &= distances <= self.max_km
+
+        serviceable = eligible.any(axis=1)
+        nearest = np.where(eligible, distances, np.inf).argmin(axis=1)
+        nearest = np.where(serviceable, nearest, distances.argmin(axis=1))
+        rows = np.arange(len(lats))
+        distance = distances[rows, nearest]
+        fees = np.rint(self.base_sen[nearest] + self.per_km_sen[nearest] * distance).astype(int)
+        return nearest, distance, fees, serviceable
+
+    def quote(self, lat, lon):
+        nearest, distance, fees, serviceable = self.quote_many([float(lat)], [float(lon)])
+        i = int(nearest[0])
+        reason = None
+        if not serviceable[0]:
+            reason = 'too_far' if self.in_areas(float(lat), float(lon)).any() else 'outside_area'
+        return Quote(self.outlets[i], float(distance[0]), int(fees[0]), bool(serviceable[0]), reason)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delivery zone tools.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    quote = sub.add_parser('quote', help="bulk-quote points from a CSV with lat,lon columns")
+    quote.add_argument('outlets')
+    quote.add_argument('points')
+    quote.add_argument('--chunk', type=int, default=10000, help="points priced per vectorized pass")
+    args = parser.parse_args()
+
+    zones = DeliveryZones.from_file(args.outlets)
+    with open(args.points, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(reader.fieldnames + ['outlet', 'distance_km', 'fee_sen', 'serviceable'])
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= args.chunk:
+                _write_quotes(zones, chunk, writer)
+                chunk = []
+        _write_quotes(zones, chunk, writer)
+
+
+def _write_quotes(zones, rows, writer):
+    if not rows:
+        return
+    nearest, distance, fees, serviceable = zones.quote_many([r['lat'] for r in rows], [r['lon'] for r in rows])
+    for row, i, d, fee, ok in zip(rows, nearest, distance, fees, serviceable):
+        writer.writerow(list(row.values()) + [zones.names[i], f"{d:.2f}", int(fee), int(ok)])
+
+
+if __name__ == '__main__':
+    main()
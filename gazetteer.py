@@ -0,0 +1,230 @@
+"""
+Offline gazetteer for Malaysian addresses.
+
+`build_index` turns a CSV extract of places/postcodes into a compact gzipped
+JSON index; `Gazetteer` loads it and answers forward queries with a token +
+prefix index and reverse lookups with a coarse lat/lon grid, so common
+addresses resolve without a Nominatim round trip.
+
+CSV columns (header required, comma or tab separated):
+    name, lat, lon[, postcode, city, state]
+An OSM extract can be produced with e.g.
+    osmconvert malaysia.osm.pbf --csv="name @lat @lon addr:postcode addr:city addr:state" --csv-headline
+
+Usage:
+    python gazetteer.py build places.csv gazetteer.json.gz
+    python gazetteer.py query gazetteer.json.gz "Menara Maybank, KL"
+    python gazetteer.py reverse gazetteer.json.gz 3.1466 101.6958
+"""
+import argparse
+import bisect
+import csv
+import gzip
+import json
+import math
+from collections import defaultdict
+
+from geocoding import normalize_query
+
+FIELDS = ['name', 'lat', 'lon', 'postcode', 'city', 'state']
+GRID_SIZE = 0.01  # degrees per reverse-lookup grid cell (~1.1 km)
+
+
+def tokenize(text):
+    return [t for t in normalize_query(text).replace(',', ' ').split() if t]
+
+
+def _read_rows(csv_path):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=',\t;')
+        reader = csv.DictReader(f, dialect=dialect)
+        for row in reader:
+            row = {(k or '').strip().lstrip('@').lower(): (v or '').strip() for k, v in row.items()}
+            # Accept OSM-style column names too
+            row.setdefault('postcode', row.get('addr:postcode', ''))
+            row.setdefault('city', row.get('addr:city', ''))
+            row.setdefault('state', row.get('addr:state', ''))
+            if not row.get('name'):
+                continue
+            try:
+                lat, lon = float(row['lat']), float(row['lon'])
+            except (KeyError, ValueError):
+                continue
+            yield [row['name'], round(lat, 6), round(lon, 6),
+                   row.get('postcode', ''), row.get('city', ''), row.get('state', '')]
+
+
+def build_index(csv_path, index_path):
+    """Import a CSV extract and write the gzipped index. Returns the number of places."""
+    places = []
+    seen = set()
+    for place in _read_rows(csv_path):
+        key = (place[0].lower(), place[1], place[2])
+        if key in seen:
+            continue
+        seen.add(key)
+        places.append(place)
+
+    with gzip.open(index_path, 'wt', encoding='utf-8') as f:
+        json.dump({'version': 1, 'fields': FIELDS, 'places': places}, f, separators=(',', ':'))
+    return len(places)
+
+
+class Gazetteer:
+    """
+    In-memory place index. `search()` and `reverse()` return results shaped
+    like Nominatim's JSON so callers can treat both sources the same way.
+    """
+
+    def __init__(self, places, min_prefix=4, max_postings=5000, reverse_radius_km=0.05, min_coverage=0.6):
+        self.places = places
+        self.min_prefix = min_prefix
+        self.max_postings = max_postings
+        self.reverse_radius_km = reverse_radius_km
+        self.min_coverage = min_coverage
+
+        self.name_tokens = []
+        # City/state-level entries ("Kuala Lumpur") whose name is just their locality
+        self.coarse = []
+        postings = defaultdict(list)
+        self.grid = defaultdict(list)
+        for i, (name, lat, lon, postcode, city, state) in enumerate(places):
+            tokens = sorted(set(tokenize(name)))
+            self.name_tokens.append(tokens)
+            self.coarse.append(set(tokens) <= set(tokenize(f"{city} {state}")))
+            for token in tokens:
+                postings[token].append(i)
+            if postcode:
+                postings[postcode].append(i)
+            self.grid[self._cell(lat, lon)].append(i)
+
+        self.postings = dict(postings)
+        self.vocabulary = sorted(self.postings)
+        total = max(1, len(places))
+        self.idf = {t: math.log(1 + total / len(ids)) for t, ids in self.postings.items()}
+
+    @classmethod
+    def load(cls, index_path, **kwargs):
+        with gzip.open(index_path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['places'], **kwargs)
+
+    def __len__(self):
+        return len(self.places)
+
+    @staticmethod
+    def _cell(lat, lon):
+        return (int(math.floor(lat / GRID_SIZE)), int(math.floor(lon / GRID_SIZE)))
+
+    def _expand(self, token):
+        """Vocabulary tokens matching `token` exactly or, for long enough tokens, by prefix."""
+        if len(token) < self.min_prefix:
+            return [token] if token in self.postings else []
+        matches = []
+        i = bisect.bisect_left(self.vocabulary, token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(token):
+            matches.append(self.vocabulary[i])
+            i += 1
+        return matches
+
+    def _result(self, i):
+        name, lat, lon, postcode, city, state = self.places[i]
+        parts = [name, city, postcode, state, 'Malaysia']
+        return {'display_name': ", ".join(p for p in parts if p),
+                'lat': str(lat), 'lon': str(lon), 'source': 'gazetteer'}
+
+    def search(self, query):
+        """
+        Forward lookup. Returns [] or a one-element list of the best place.
+
+        Landmarks and postcode matches answer directly. A city- or state-level
+        entry only answers when its name covers at least `min_coverage` of the
+        query's words, so "123 Jalan Bukit Bintang, Kuala Lumpur" is left to
+        Nominatim instead of resolving to the city centre.
+        """
+        query_tokens = tokenize(query)
+        expansions = []
+        candidates = set()
+        for token in query_tokens:
+            expanded = set(self._expand(token))
+            expansions.append(expanded)
+            for vocab_token in expanded:
+                ids = self.postings[vocab_token]
+                # Very common words ("jalan", "taman") still count when scoring but
+                # are too broad to generate candidates from
+                if len(ids) <= self.max_postings:
+                    candidates.update(ids)
+        matched = set().union(*expansions)
+
+        best, best_score = None, 0.0
+        for i in candidates:
+            tokens = self.name_tokens[i]
+            # Every word of the place name must appear in the query
+            if not tokens or any(t not in matched for t in tokens):
+                continue
+            postcode = self.places[i][3]
+            postcode_match = bool(postcode) and postcode in matched
+            if self.coarse[i] and not postcode_match:
+                covered = sum(1 for expanded in expansions if expanded & set(tokens))
+                if covered < self.min_coverage * len(query_tokens):
+                    continue
+            score = sum(self.idf[t] for t in tokens)
+            if postcode_match:
+                score += self.idf[postcode]
+            if score > best_score:
+                best, best_score = i, score
+
+        return [self._result(best)] if best is not None else []
+
+    def reverse(self, lat, lon):
+        """
+        Nearest place within `reverse_radius_km`, as a Nominatim-style dict, or
+        None. The default radius is building scale: the result becomes the
+        delivery address, so a pin down the street from a mall must not be
+        saved as the mall, and city-level entries are never returned.
+        """
+        lat, lon = float(lat), float(lon)
+        row, col = self._cell(lat, lon)
+        cos_lat = math.cos(math.radians(lat))
+        best, best_km = None, self.reverse_radius_km
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                for i in self.grid.get((row + dr, col + dc), ()):
+                    if self.coarse[i]:
+                        continue
+                    _, plat, plon = self.places[i][:3]
+                    # Equirectangular approximation is plenty at this range
+                    km = 111.195 * math.hypot(plat - lat, (plon - lon) * cos_lat)
+                    if km <= best_km:
+                        best, best_km = i, km
+        return self._result(best) if best is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the offline address gazetteer.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="import a CSV extract into an index")
+    build.add_argument('csv_path')
+    build.add_argument('index_path')
+    query = sub.add_parser('query', help="forward lookup")
+    query.add_argument('index_path')
+    query.add_argument('text')
+    reverse = sub.add_parser('reverse', help="reverse lookup")
+    reverse.add_argument('index_path')
+    reverse.add_argument('lat', type=float)
+    reverse.add_argument('lon', type=float)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        count = build_index(args.csv_path, args.index_path)
+        print(f"✅ Indexed {count} places into {args.index_path}")
+    elif args.command == 'query':
+        print(json.dumps(Gazetteer.load(args.index_path).search(args.text), indent=2))
+    else:
+        print(json.dumps(Gazetteer.load(args.index_path).reverse(args.lat, args.lon), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""
+Geocoding helpers shared by the address handlers.
+
+GeocodeCache keeps Nominatim answers under a normalized key with LRU + TTL
+eviction, optionally backed by SQLite so the cache survives restarts.
+NominatimClient is the one shared HTTP client: pooled keep-alive connections,
+per-call timeouts, a token-bucket rate limit (Nominatim allows 1 req/s) and
+coalescing of identical in-flight queries.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def normalize_query(text):
+    """Lower-case, drop punctuation (except commas) and collapse whitespace."""
+    text = re.sub(r'[^\w\s,]', ' ', text.lower())
+    text = re.sub(r'\s*,\s*', ', ', text)
+    return " ".join(text.split()).strip(', ')
+
+
+def search_key(query):
+    return 'search:' + normalize_query(query)
+
+
+def reverse_key(lat, lon, precision=5):
+    # 5 decimal places is roughly 1 m, well inside GPS accuracy
+    return f"reverse:{round(float(lat), precision)},{round(float(lon), precision)}"
+
+
+class GeocodeCache:
+    """
+    Thread-safe LRU cache with per-entry expiry. Values must be JSON-serializable.
+    If `db_path` is given, entries are written through to SQLite and misses in
+    memory fall back to the database before counting as a real miss.
+    """
+
+    def __init__(self, maxsize=10000, ttl=7 * 24 * 3600, db_path=None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            self._db.execute("DELETE FROM geocode WHERE expires < ?", (time.time(),))
+            self._db.commit()
+
+    def get(self, key):
+        """Return the cached value, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM geocode WHERE key = ?", (key,)).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._store(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, value, expires)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO geocode (key, value, expires) VALUES (?, ?, ?)",
+                                 (key, json.dumps(value), expires))
+                self._db.commit()
+
+    def _store(self, key, value, expires):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class RequestCancelled(Exception):
+    """Raised when a queued request is cancelled before it was sent."""
+
+
+class GeocoderUnavailable(Exception):
+    """Raised when nothing was found but some queries failed (timeouts, HTTP errors)."""
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None, cancel=None):
+        """
+        Take one token, waiting for it if needed. Returns False if `timeout`
+        passes or the `cancel` event is set first.
+        """
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            if cancel is not None:
+                if cancel.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+class NominatimClient:
+    """
+    Shared Nominatim client. `search()` and `reverse()` return Nominatim's JSON
+    (a list and a dict respectively), served from `cache` when possible.
+    """
+
+    def __init__(self, base_url="https://nominatim.openstreetmap.org", user_agent='NasiKandarBot/1.0',
+                 rate=1.0, burst=1, timeout=5.0, queue_timeout=10.0, pool_size=4, cache=None, metrics=None):
+        self.base_url = base_url.rstrip('/')
+        self.metrics = metrics
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.cache = cache
+        self.limiter = TokenBucket(rate, burst)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Fallback queries run here so they can overlap the rate-limit wait
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='nominatim')
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    def _get(self, path, params, cancel=None):
+        if not self.limiter.acquire(timeout=self.queue_timeout, cancel=cancel):
+            if cancel is not None and cancel.is_set():
+                raise RequestCancelled(path)
+            raise TimeoutError(f"Nominatim rate limit queue exceeded {self.queue_timeout}s")
+        with self._lock:
+            self.sent += 1
+        t0 = time.perf_counter()
+        try:
+            response = self.session.get(f"{self.base_url}/{path}", params=params, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe('nominatim_request_seconds', time.perf_counter() - t0, endpoint=path)
+
+    def _fetch(self, key, path, params, cancel=None):
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        while True:
+            with self._lock:
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = self._inflight[key] = Future()
+                else:
+                    self.coalesced += 1
+
+            if not owner:
+                try:
+                    return future.result()
+                except RequestCancelled:
+                    # The request we piggy-backed on was dropped; send our own
+                    continue
+
+            try:
+                result = self._get(path, params, cancel)
+            except RequestCancelled as e:
+                with self._lock:
+                    self.cancelled += 1
+                future.set_exception(e)
+                raise
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                future.set_exception(e)
+                raise
+            else:
+                # Waiters first: a failing cache write must not leave them blocked
+                future.set_result(result)
+                if self.cache is not None:
+                    try:
+                        self.cache.set(key, result)
+                    except Exception as e:
+                        print(f"⚠️ Could not cache geocode result: {e}")
+                return result
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+    def search(self, query, cancel=None):
+        """Forward geocode one query (Malaysia only)."""
+        params = {'q': query, 'countrycodes': 'my', 'format': 'json', 'limit': 1}
+        return self._fetch(search_key(query), 'search', params, cancel)
+
+    def reverse(self, lat, lon):
+        params = {'lat': lat, 'lon': lon, 'format': 'json'}
+        return self._fetch(reverse_key(lat, lon), 'reverse', params)
+
+    def search_first(self, queries):
+        """
+        Return (index, results) for the first query, in the given order, that
+        found something — or (None, []) if none did. The first (exact) query
+        goes out alone so fallbacks never take its place in the rate limiter;
+        only if it finds nothing do the rest run concurrently, and those still
+        waiting are cancelled as soon as an earlier one succeeds. Raises
+        GeocoderUnavailable when nothing was found but a query failed, so a
+        timeout is not mistaken for "no such address".
+        """
+        errors = []
+        try:
+            result = self.search(queries[0])
+            if len(result) > 0:
+                return 0, result
+        except Exception as e:
+            print(f"Nominatim search failed for {queries[0]!r}: {e}")
+            errors.append(e)
+
+        cancel = threading.Event()
+        futures = [self._executor.submit(self.search, query, cancel) for query in queries[1:]]
+        try:
+            for i, future in enumerate(futures, start=1):
+                try:
+                    result = future.result()
+                except RequestCancelled:
+                    continue
+                except Exception as e:
+                    print(f"Nominatim search failed for {queries[i]!r}: {e}")
+                    errors.append(e)
+                    continue
+                if len(result) > 0:
+                    return i, result
+        finally:
+            cancel.set()
+            for future in futures:
+                future.cancel()
+        if errors:
+            raise GeocoderUnavailable(f"{len(errors)} of {len(queries)} queries failed: {errors[0]}") from errors[0]
+        return None, []
+
+    def stats(self):
+        with self._lock:
+            stats = {'sent': self.sent, 'coalesced': self.coalesced,
+                     'errors': self.errors, 'cancelled': self.cancelled,
+                     'inflight': len(self._inflight)}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
@@ -0,0 +1,248 @@
+"""
+Append-only order ledger.
+
+Every completed order is one JSON line in a segment file
+`<dir>/<name>-00000001.jsonl`. Appends are buffered and a background thread
+writes and fsyncs them in groups (every `fsync_interval` seconds), so handlers
+never wait on the disk. A segment is closed and the next one started once it
+passes `segment_bytes`. Segments are never rewritten, so the kitchen or
+accounting can stream them with `read_orders` or follow them live with `tail`.
+
+Records are self-describing (item names and unit prices at the time of sale),
+so they can be aggregated without the bot's menu:
+    python ledger.py daily orders/
+    python ledger.py tail orders/
+"""
+import argparse
+import atexit
+import glob
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+SEGMENT_PATTERN = re.compile(r'^(?P<name>.+)-(?P<seq>\d{8})\.jsonl$')
+
+
+def segment_files(directory):
+    """All segment paths in `directory`, oldest first within each ledger name."""
+    found = []
+    for path in glob.glob(os.path.join(directory, '*.jsonl')):
+        match = SEGMENT_PATTERN.match(os.path.basename(path))
+        if match:
+            found.append((match.group('name'), int(match.group('seq')), path))
+    return [path for _, _, path in sorted(found)]
+
+
+class OrderLedger:
+    """
+    `append(record)` queues one order; it is on disk (fsynced) within
+    `fsync_interval` seconds. Several processes can share a directory as long
+    as each uses its own `name`.
+    """
+
+    def __init__(self, directory, name='orders', segment_bytes=64 * 1024 * 1024, fsync_interval=0.2):
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        existing = [p for p in segment_files(directory)
+                    if SEGMENT_PATTERN.match(os.path.basename(p)).group('name') == name]
+        self._seq = int(SEGMENT_PATTERN.match(os.path.basename(existing[-1])).group('seq')) if existing else 1
+        self._file = None
+        self._open_segment()
+
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self.appended = 0
+        self.written = 0
+        self.fsyncs = 0
+        self.rotations = 0
+        self._thread = threading.Thread(target=self._run, name="order-ledger", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{self.name}-{seq:08d}.jsonl")
+
+    def _open_segment(self):
+        self._file = open(self._segment_path(self._seq), 'ab')
+        # A crash can leave a torn last line; start on a fresh line so readers can skip it
+        if self._file.tell() > 0:
+            with open(self._segment_path(self._seq), 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write(b'\n')
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Order ledger is closed")
+            self._buffer.append(line)
+            self.appended += 1
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer and self._closed:
+                    return
+            # Let more orders join this group before paying for the fsync
+            time.sleep(self.fsync_interval)
+            self.flush()
+
+    def flush(self):
+        """Write and fsync everything appended so far."""
+        with self._cond:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        try:
+            self._file.write(b''.join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            print(f"⚠️ Order ledger write failed: {e}")
+            with self._cond:
+                self._buffer[:0] = lines
+            return
+        with self._cond:
+            self.written += len(lines)
+            self.fsyncs += 1
+        if self._file.tell() >= self.segment_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._seq += 1
+        self._open_segment()
+        self.rotations += 1
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self.flush()
+        self._file.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'appended': self.appended,
+                'written': self.written,
+                'buffered': len(self._buffer),
+                'fsyncs': self.fsyncs,
+                'rotations': self.rotations,
+                'segment': self._seq,
+            }
+
+
+# =======================================================
+#                      READING
+# =======================================================
+def _complete_lines(f):
+    """JSON records from an open binary file, stopping at an unterminated last line."""
+    while True:
+        position = f.tell()
+        line = f.readline()
+        if not line:
+            return
+        if not line.endswith(b'\n'):
+            # Still being written (or torn by a crash): leave it for the next read
+            f.seek(position)
+            return
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def read_orders(directory):
+    """Stream every order in the ledger, one segment at a time."""
+    for path in segment_files(directory):
+        with open(path, 'rb') as f:
+            yield from _complete_lines(f)
+
+
+def tail(directory, from_start=False, poll_interval=1.0):
+    """Follow the ledger: yield orders as they are appended, picking up new segments."""
+    offsets = {}
+    if not from_start:
+        for path in segment_files(directory):
+            offsets[path] = os.path.getsize(path)
+    while True:
+        for path in segment_files(directory):
+            with open(path, 'rb') as f:
+                f.seek(offsets.get(path, 0))
+                yield from _complete_lines(f)
+                offsets[path] = f.tell()
+        time.sleep(poll_interval)
+
+
+def daily_totals(orders, utc_offset_hours=8):
+    """
+    {day: {'orders', 'revenue_sen', 'food_sen', 'delivery_sen', 'items': {name: qty}}}
+    computed in one pass, so memory grows with days x menu items, not orders.
+    """
+    tz = timezone(timedelta(hours=utc_offset_hours))
+    days = defaultdict(lambda: {'orders': 0, 'revenue_sen': 0, 'food_sen': 0, 'delivery_sen': 0,
+                                'items': defaultdict(int)})
+    for order in orders:
+        day = days[datetime.fromtimestamp(order['ts'], tz).strftime('%Y-%m-%d')]
+        day['orders'] += 1
+        day['revenue_sen'] += order.get('total_sen', 0)
+        day['food_sen'] += order.get('food_sen', 0)
+        day['delivery_sen'] += order.get('delivery_sen', 0)
+        for item in order.get('items', []):
+            day['items'][item['name']] += item['qty']
+    return {d: dict(v, items=dict(v['items'])) for d, v in sorted(days.items())}
+
+
+def main():
+    from menu import format_rm
+
+    parser = argparse.ArgumentParser(description="Order ledger tools.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    daily = sub.add_parser('daily', help="item counts and revenue per day")
+    daily.add_argument('directory')
+    daily.add_argument('--utc-offset', type=float, default=8, help="hours; days are cut at local midnight")
+    daily.add_argument('--json', action='store_true')
+    follow = sub.add_parser('tail', help="print orders as they are written")
+    follow.add_argument('directory')
+    follow.add_argument('--from-start', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'tail':
+        try:
+            for order in tail(args.directory, from_start=args.from_start):
+                print(json.dumps(order, ensure_ascii=False), flush=True)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    totals = daily_totals(read_orders(args.directory), utc_offset_hours=args.utc_offset)
+    if args.json:
+        print(json.dumps(totals, indent=2, ensure_ascii=False))
+        return
+    for day, total in totals.items():
+        print(f"📅 {day}: {total['orders']} orders, revenue {format_rm(total['revenue_sen'])} "
+              f"(food {format_rm(total['food_sen'])}, delivery {format_rm(total['delivery_sen'])})")
+        for name, qty in sorted(total['items'].items(), key=lambda kv: -kv[1]):
+            print(f"    {qty:>5} x {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compiled menu catalogue and compact carts.
+
+The MENU_ITEMS dict is compiled once at load: prices become integer sen (no
+float drift) and the menu listing is rendered to text up front. A cart is
+stored in the chat's session as {'cart': {item_key: quantity}, 'food_sen': total}
+— plain JSON so it persists with the session store — and cart summaries are
+rendered through an LRU cache keyed on the cart contents.
+"""
+import functools
+
+CART_STYLES = {
+    'numbered': "{i}. {name} - {amount}",
+    'bullets': "• {name}: {amount}",
+    'receipt': "🍛 {name} - {amount}",
+}
+
+
+def parse_price_sen(price):
+    """'RM 12.00' -> 1200"""
+    ringgit, _, sen = price.replace('RM', '').strip().partition('.')
+    return int(ringgit or 0) * 100 + int((sen + '00')[:2])
+
+
+def format_rm(sen):
+    """1200 -> 'RM 12.00'"""
+    sign = '-' if sen < 0 else ''
+    sen = abs(int(sen))
+    return f"RM {sign}{sen // 100}.{sen % 100:02d}"
+
+
+class Menu:
+    def __init__(self, items):
+        self.items = {key: (item['name'], parse_price_sen(item['price'])) for key, item in items.items()}
+        # Pre-rendered "*1.* Name - RM 12.00" listing
+        self.listing = "".join(f"*{key}.* {name} - {format_rm(sen)}\n" for key, (name, sen) in self.items.items())
+        self._render = functools.lru_cache(maxsize=4096)(self._render_cart)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def name(self, key):
+        return self.items[key][0]
+
+    def price_sen(self, key):
+        return self.items[key][1]
+
+    # --- carts ---
+    @staticmethod
+    def new_cart():
+        return {'cart': {}, 'food_sen': 0}
+
+    def add_to_cart(self, state, key):
+        """Add one of `key` to the cart in session `state`, keeping the total up to date."""
+        cart = state['cart']
+        cart[key] = cart.get(key, 0) + 1
+        state['food_sen'] += self.price_sen(key)
+
+    def cart_text(self, state, style='numbered'):
+        """Cart lines in one of CART_STYLES, one line per item with quantities merged."""
+        return self._render(tuple(state['cart'].items()), style)
+
+    def cache_info(self):
+        return self._render.cache_info()
+
+    def _render_cart(self, items, style):
+        template = CART_STYLES[style]
+        lines = []
+        for i, (key, qty) in enumerate(items, 1):
+            name, sen = self.items[key]
+            label = f"{name} x{qty}" if qty > 1 else name
+            lines.append(template.format(i=i, name=label, amount=format_rm(sen * qty)))
+        return "\n".join(lines)
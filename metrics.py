@@ -0,0 +1,191 @@
+"""
+Lightweight metrics for the bot's hot paths.
+
+Metrics collects counters and timing histograms from the handlers, plus gauges
+pulled from registered collectors (queue depths, cache stats) at scrape time,
+and renders them in the Prometheus text format. `start_metrics_server` serves
+them on a local HTTP port; SlowUpdateProfiler samples updates with cProfile
+and keeps the profiles of slow ones.
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "nasibot_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = defaultdict(float)  # (name, labels) -> value
+        self._timers = {}                    # (name, labels) -> [count, sum, per-bucket counts]
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, _labels_key(labels))] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = [0, 0.0, [0] * len(self.buckets)]
+            timer[0] += 1
+            timer[1] += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    timer[2][i] += 1
+                    break
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the block as histogram `name`; exceptions also count in errors_total{stage=name}."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('errors_total', stage=name)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def add_collector(self, collector):
+        """`collector()` returns an iterable of (gauge_name, labels_dict, value), read at scrape time."""
+        self._collectors.append(collector)
+
+    def _gauges(self):
+        gauges = []
+        for collector in self._collectors:
+            try:
+                gauges.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return gauges
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted((k, [v[0], v[1], list(v[2])]) for k, v in self._timers.items())
+
+        lines = []
+        typed = set()
+
+        def type_line(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), value in counters:
+            type_line(name, 'counter')
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), (count, total, bucket_counts) in timers:
+            type_line(name, 'histogram')
+            cumulative = 0
+            for bound, n in zip(self.buckets, bucket_counts):
+                cumulative += n
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+
+        for name, labels, value in self._gauges():
+            type_line(name, 'gauge')
+            lines.append(f"{PREFIX}{name}{_format_labels(_labels_key(labels))} {float(value):g}")
+
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(metrics, port, host='127.0.0.1'):
+    """Serve `metrics.render()` at http://host:port/metrics on a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+class SlowUpdateProfiler:
+    """
+    Times every update as `update_seconds`. A random `sample_rate` fraction of
+    updates runs under cProfile; if a sampled update takes longer than
+    `threshold` seconds its profile is written to `out_dir` and the top entries
+    are printed.
+    """
+
+    def __init__(self, metrics, threshold=1.0, sample_rate=0.0, out_dir='profiles'):
+        self.metrics = metrics
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.out_dir = out_dir
+
+    def run(self, label, fn):
+        profile = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is already active on this interpreter
+                profile = None
+
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            elapsed = time.perf_counter() - t0
+            if profile is not None:
+                profile.disable()
+            self.metrics.observe('update_seconds', elapsed)
+            if elapsed > self.threshold:
+                self.metrics.inc('slow_updates_total')
+                if profile is not None:
+                    self._save(label, elapsed, profile)
+
+    def _save(self, label, elapsed, profile):
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, f"{int(time.time() * 1000)}-{label}.prof")
+            profile.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(15)
+            print(f"🐢 Slow update {label} took {elapsed:.2f}s — profile saved to {path}\n{out.getvalue()}")
+        except Exception as e:
+            print(f"Could not save profile: {e}")
@@ -0,0 +1,99 @@
+"""
+Background model loading and startup-phase timing.
+
+Heavy imports (torch/transformers) and model weights are loaded on a daemon
+thread so the bot can start polling straight away; handlers that need the
+model wait on its readiness instead of the whole process waiting at import.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimings:
+    """
+    Records how long each startup phase took, plus milestones measured from
+    the moment this object was created (i.e. process start).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.milestones = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - t0
+
+    def mark(self, name):
+        with self._lock:
+            self.milestones[name] = time.perf_counter() - self.started
+
+    def report(self):
+        with self._lock:
+            phases = ", ".join(f"{k}={v:.2f}s" for k, v in self.phases.items())
+            milestones = ", ".join(f"{k}@{v:.2f}s" for k, v in self.milestones.items())
+        return f"phases: {phases or '-'} | milestones: {milestones or '-'}"
+
+    def save(self, path, release=None):
+        """Append this run's timings as one JSON line so cold starts can be compared across releases."""
+        with self._lock:
+            record = {
+                'ts': time.time(),
+                'release': release,
+                'phases': {k: round(v, 4) for k, v in self.phases.items()},
+                'milestones': {k: round(v, 4) for k, v in self.milestones.items()},
+            }
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class BackgroundModel:
+    """
+    Runs `loader()` once on a daemon thread. `ready` is set when loading has
+    finished, successfully or not; `wait()` blocks until then and returns the
+    loaded model (or None if loading failed).
+    """
+
+    def __init__(self, loader, name="model"):
+        self.loader = loader
+        self.name = name
+        self.model = None
+        self.error = None
+        self.ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name=f"{self.name}-loader", daemon=True)
+                self._thread.start()
+        return self
+
+    def _load(self):
+        try:
+            self.model = self.loader()
+        except Exception as e:
+            print(f"⚠️ Background load of {self.name} failed: {e}")
+            self.error = e
+        finally:
+            self.ready.set()
+
+    def wait(self, timeout=None):
+        self.start()
+        self.ready.wait(timeout)
+        return self.model
+
+    @property
+    def status(self):
+        if not self.ready.is_set():
+            return 'loading'
+        return 'ready' if self.model is not None else 'failed'
@@ -0,0 +1,118 @@
+"""
+Telegram file_id caching for payment QR images.
+
+Telegram returns a file_id for every photo we upload; sending that id again
+costs no upload at all. FileIdCache remembers ids for static files (persisted
+to JSON so restarts don't re-upload), and AmountQRCache keeps a small LRU of
+per-amount QR images — rendered in memory when the optional `qrcode` package
+is installed — together with their file_ids once sent.
+"""
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+try:
+    import qrcode
+except ImportError:
+    qrcode = None
+
+CHART_URL = "https://chart.googleapis.com/chart?cht=qr&chs=400x400&chl={}"
+
+
+def file_key(path):
+    """Cache key that changes whenever the file is replaced or edited."""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{int(st.st_mtime)}"
+
+
+def sent_file_id(message):
+    """file_id of the photo/document in a message returned by send_photo/send_document."""
+    if getattr(message, 'photo', None):
+        return message.photo[-1].file_id
+    if getattr(message, 'document', None):
+        return message.document.file_id
+    return None
+
+
+class FileIdCache:
+    """key -> Telegram file_id, saved to `path` (if given) on every change."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._ids = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self._ids = json.load(f)
+            except Exception as e:
+                print(f"Could not read file_id cache {path}: {e}")
+
+    def get(self, key):
+        with self._lock:
+            return self._ids.get(key)
+
+    def set(self, key, file_id):
+        if not file_id:
+            return
+        with self._lock:
+            self._ids[key] = file_id
+            self._save()
+
+    def discard(self, key):
+        with self._lock:
+            if self._ids.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._ids, f)
+        os.replace(tmp_path, self.path)
+
+
+class AmountQRCache:
+    """
+    LRU of per-amount payment QRs. `photo(text)` returns what to pass to
+    send_photo: a cached file_id, freshly rendered PNG bytes, or a chart URL.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # text -> {'png': bytes|None, 'file_id': str|None}
+        self._lock = threading.Lock()
+
+    def _entry(self, text):
+        entry = self._entries.get(text)
+        if entry is None:
+            entry = self._entries[text] = {'png': None, 'file_id': None}
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(text)
+        return entry
+
+    def photo(self, text):
+        with self._lock:
+            entry = self._entry(text)
+            if entry['file_id']:
+                return entry['file_id']
+            if entry['png'] is None and qrcode is not None:
+                buffer = io.BytesIO()
+                qrcode.make(text).save(buffer, format='PNG')
+                entry['png'] = buffer.getvalue()
+            return entry['png'] or CHART_URL.format(quote(text))
+
+    def remember(self, text, file_id):
+        with self._lock:
+            self._entry(text)['file_id'] = file_id
+
+    def forget(self, text):
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry:
+                entry['file_id'] = None
@@ -0,0 +1,281 @@
+"""
+Selectable CPU inference backends for the receipt VQA model.
+
+    pipeline   the fp32 transformers pipeline (reference answers)
+    quantized  the same pipeline with its Linear layers dynamically quantized to int8
+    onnx       an exported ONNX Runtime graph (optionally int8-quantized at export)
+
+Every backend returns a scanner with the pipeline's calling convention,
+`scanner([{'image': ..., 'question': ...}, ...], batch_size=n)` -> one list of
+{'answer', 'score'} dicts per input, so ReceiptBatcher can use any of them.
+
+Usage:
+    python receipt_backends.py export-onnx vilt.onnx [--quantize]
+    python receipt_backends.py compare fixtures/receipts --backends pipeline,quantized,onnx --onnx-path vilt.onnx
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from receipt_engine import RECEIPT_QUESTION, TOTAL_QUESTION, ReceiptImage, first_answer, receipt_verdict
+
+MODEL_NAME = "dandelin/vilt-b32-finetuned-vqa"
+BACKENDS = ('pipeline', 'quantized', 'onnx')
+ONNX_INPUTS = ['input_ids', 'attention_mask', 'token_type_ids', 'pixel_values', 'pixel_mask']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def rss_mb():
+    """Resident memory of this process in MB (0 if it can't be read)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def load_scanner(backend='pipeline', model_name=MODEL_NAME, onnx_path=None, threads=None):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown receipt backend {backend!r} (choose from {', '.join(BACKENDS)})")
+
+    if backend == 'onnx':
+        if not onnx_path or not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"ONNX model not found at {onnx_path!r} (run `python receipt_backends.py export-onnx`)")
+        return OnnxVQAScanner(onnx_path, model_name, threads=threads)
+
+    import torch
+    from transformers import pipeline
+    if threads:
+        torch.set_num_threads(threads)
+    scanner = pipeline("visual-question-answering", model=model_name)
+    if backend == 'quantized':
+        scanner.model = torch.quantization.quantize_dynamic(scanner.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return scanner
+
+
+class OnnxVQAScanner:
+    """ViLT VQA on ONNX Runtime, using the HF processor for pre-processing."""
+
+    def __init__(self, onnx_path, model_name=MODEL_NAME, threads=None):
+        import numpy as np
+        import onnxruntime as ort
+        from transformers import ViltConfig, ViltProcessor
+
+        self.np = np
+        self.processor = ViltProcessor.from_pretrained(model_name)
+        self.id2label = ViltConfig.from_pretrained(model_name).id2label
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def __call__(self, inputs, batch_size=None, top_k=1):
+        np = self.np
+        single = isinstance(inputs, dict)
+        if single:
+            inputs = [inputs]
+
+        results = []
+        step = batch_size or len(inputs)
+        for start in range(0, len(inputs), step):
+            chunk = inputs[start:start + step]
+            encoded = self.processor(images=[x['image'] for x in chunk],
+                                     text=[x['question'] for x in chunk],
+                                     return_tensors='np', padding=True, truncation=True)
+            feed = {}
+            for name in ONNX_INPUTS:
+                if name in self.input_names and name in encoded:
+                    value = encoded[name]
+                    feed[name] = value.astype(np.float32) if name == 'pixel_values' else value.astype(np.int64)
+            logits = self.session.run(['logits'], feed)[0]
+            # ViLT's VQA head is multi-label: scores are sigmoids, as in the pipeline
+            scores = 1.0 / (1.0 + np.exp(-logits))
+            for row in scores:
+                top = np.argsort(row)[::-1][:top_k]
+                results.append([{'score': float(row[i]), 'answer': self.id2label[int(i)]} for i in top])
+        return results[0] if single else results
+
+
+def export_onnx(path, model_name=MODEL_NAME, quantize=False, opset=14):
+    """Export ViLT VQA to ONNX with dynamic batch/sequence/image axes. Returns the written path."""
+    import torch
+    from PIL import Image
+    from transformers import ViltForQuestionAnswering, ViltProcessor
+
+    processor = ViltProcessor.from_pretrained(model_name)
+    model = ViltForQuestionAnswering.from_pretrained(model_name).eval()
+    encoded = processor(images=Image.new('RGB', (640, 480), 'white'), text=RECEIPT_QUESTION, return_tensors='pt')
+    args = tuple(encoded[name] for name in ONNX_INPUTS)
+
+    fp32_path = path if not quantize else path + ".fp32"
+    with torch.no_grad():
+        torch.onnx.export(
+            model, args, fp32_path,
+            input_names=ONNX_INPUTS, output_names=['logits'], opset_version=opset,
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'token_type_ids': {0: 'batch', 1: 'sequence'},
+                'pixel_values': {0: 'batch', 2: 'height', 3: 'width'},
+                'pixel_mask': {0: 'batch', 1: 'height', 2: 'width'},
+                'logits': {0: 'batch'},
+            })
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    return path
+
+
+# =======================================================
+#              ACCURACY / LATENCY / RSS CHECK
+# =======================================================
+def _fixture_images(images_dir):
+    return sorted(f for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def run_backend(backend, images_dir, onnx_path=None, threads=None, max_side=640):
+    """Load one backend, answer both questions for every fixture image, and measure it."""
+    rss_before = rss_mb()
+    t0 = time.perf_counter()
+    scanner = load_scanner(backend, onnx_path=onnx_path, threads=threads)
+    load_s = time.perf_counter() - t0
+
+    answers = {}
+    latencies = []
+    for name in _fixture_images(images_dir):
+        with open(os.path.join(images_dir, name), 'rb') as f:
+            image = ReceiptImage(f.read(), max_side=max_side).model_image
+        inputs = [{'image': image, 'question': RECEIPT_QUESTION}, {'image': image, 'question': TOTAL_QUESTION}]
+        t0 = time.perf_counter()
+        result1, result2 = scanner(inputs, batch_size=2)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        answer1, answer2 = first_answer(result1), first_answer(result2)
+        answers[name] = {
+            'receipt': [answer1.get('answer'), round(answer1.get('score', 0), 4)],
+            'total': [answer2.get('answer'), round(answer2.get('score', 0), 4)],
+            'verdict': receipt_verdict(result1, result2),
+        }
+
+    return {
+        'backend': backend,
+        'load_s': round(load_s, 2),
+        'rss_mb': round(rss_mb(), 1),
+        'model_rss_mb': round(rss_mb() - rss_before, 1),
+        'latency_ms': [round(x, 1) for x in latencies],
+        'answers': answers,
+    }
+
+
+def compare(images_dir, backends, onnx_path=None, threads=None, reference=None):
+    """
+    Run each backend in its own process (so RSS is measured in isolation) and
+    print latency, memory and agreement with the reference backend's answers.
+    """
+    reports = {}
+    for backend in backends:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            out_path = f.name
+        cmd = [sys.executable, os.path.abspath(__file__), 'run', backend, images_dir, '--json', out_path]
+        if onnx_path:
+            cmd += ['--onnx-path', onnx_path]
+        if threads:
+            cmd += ['--threads', str(threads)]
+        print(f"⏳ Running {backend}...")
+        try:
+            subprocess.run(cmd, check=True)
+            with open(out_path, encoding='utf-8') as f:
+                reports[backend] = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Backend {backend} failed: {e}")
+        finally:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+    if reference:
+        with open(reference, encoding='utf-8') as f:
+            reference_answers = json.load(f)['answers']
+    elif 'pipeline' in reports:
+        reference_answers = reports['pipeline']['answers']
+    else:
+        reference_answers = None
+
+    print(f"\n{'backend':10} {'load s':>7} {'p50 ms':>8} {'mean ms':>8} {'RSS MB':>8} {'model MB':>9} "
+          f"{'answers':>8} {'verdicts':>9}")
+    for backend, report in reports.items():
+        latencies = report['latency_ms'] or [0.0]
+        answer_match = verdict_match = '-'
+        if reference_answers:
+            names = [n for n in report['answers'] if n in reference_answers]
+            if names:
+                same_answers = sum(report['answers'][n][q][0] == reference_answers[n][q][0]
+                                   for n in names for q in ('receipt', 'total'))
+                same_verdicts = sum(report['answers'][n]['verdict'] == reference_answers[n]['verdict'] for n in names)
+                answer_match = f"{100.0 * same_answers / (2 * len(names)):.1f}%"
+                verdict_match = f"{100.0 * same_verdicts / len(names):.1f}%"
+        print(f"{backend:10} {report['load_s']:>7} {statistics.median(latencies):>8.1f} "
+              f"{statistics.mean(latencies):>8.1f} {report['rss_mb']:>8} {report['model_rss_mb']:>9} "
+              f"{answer_match:>8} {verdict_match:>9}")
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receipt VQA inference backends.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export = sub.add_parser('export-onnx', help="export the VQA model to ONNX")
+    export.add_argument('path')
+    export.add_argument('--quantize', action='store_true', help="also apply int8 dynamic quantization")
+
+    run = sub.add_parser('run', help="run one backend over a fixture directory")
+    run.add_argument('backend', choices=BACKENDS)
+    run.add_argument('images_dir')
+    run.add_argument('--onnx-path')
+    run.add_argument('--threads', type=int)
+    run.add_argument('--json', help="write the report here instead of stdout")
+
+    check = sub.add_parser('compare', help="compare backends on accuracy, latency and RSS")
+    check.add_argument('images_dir')
+    check.add_argument('--backends', default='pipeline,quantized')
+    check.add_argument('--onnx-path')
+    check.add_argument('--threads', type=int)
+    check.add_argument('--reference', help="saved `run pipeline --json` report to compare against")
+    check.add_argument('--json', help="also write all reports here")
+    args = parser.parse_args()
+
+    if args.command == 'export-onnx':
+        print(f"✅ Exported {export_onnx(args.path, quantize=args.quantize)}")
+    elif args.command == 'run':
+        report = run_backend(args.backend, args.images_dir, onnx_path=args.onnx_path, threads=args.threads)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+    else:
+        backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+        reports = compare(args.images_dir, backends, onnx_path=args.onnx_path,
+                          threads=args.threads, reference=args.reference)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
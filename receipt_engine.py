@@ -0,0 +1,169 @@
+"""
+Batched receipt verification engine.
+
+Receipts from every chat are queued here and a single background worker
+answers both VQA questions for all queued images in batched forward passes,
+one per image size. Each caller gets a Future back and waits only for its own answers.
+"""
+import io
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from PIL import Image
+
+RECEIPT_QUESTION = "Is this a receipt?"
+TOTAL_QUESTION = "How much is the total?"
+
+
+def first_answer(result):
+    """Return the top answer dict from a pipeline result (dict or list of dicts)."""
+    if isinstance(result, dict):
+        return result
+    if isinstance(result, list) and len(result) > 0 and isinstance(result[0], dict):
+        return result[0]
+    return {}
+
+
+def receipt_verdict(receipt_result, total_result, min_score=0.5):
+    """True if the model confidently said "yes, a receipt" and confidently read a total."""
+    answer1 = first_answer(receipt_result)
+    answer2 = first_answer(total_result)
+    is_receipt_confident = answer1.get('score', 0) > min_score and 'yes' in answer1.get('answer', '').lower()
+    total_confident = answer2.get('score', 0) > min_score and answer2.get('answer', '') != ''
+    return is_receipt_confident and total_confident
+
+
+def read_total(total_result):
+    """The model's answer to TOTAL_QUESTION, normalised for comparison ('RM 24.50' -> '24.50'), or None."""
+    answer = first_answer(total_result).get('answer', '')
+    return re.sub(r'(?i)^rm|[^\w.]', '', answer.strip()) or None
+
+
+def _load(image):
+    return Image.open(image).convert('RGB') if isinstance(image, str) else image
+
+
+class ReceiptImage:
+    """
+    A downloaded receipt, decoded once straight from memory.
+    `image` is the full RGB picture; `model_image` is the copy downscaled so its
+    longest side is at most `max_side` (0 keeps the original size).
+    """
+
+    def __init__(self, image_bytes, max_side=640):
+        self.data = image_bytes
+        self.max_side = max_side
+        self._image = None
+        self._model_image = None
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = Image.open(io.BytesIO(self.data)).convert('RGB')
+        return self._image
+
+    @property
+    def model_image(self):
+        if self._model_image is None:
+            image = self.image
+            if self.max_side and max(image.size) > self.max_side:
+                image = image.copy()
+                image.thumbnail((self.max_side, self.max_side), Image.BILINEAR)
+            self._model_image = image
+        return self._model_image
+
+
+class ReceiptBatcher:
+    """
+    Collects receipts into batches of up to `max_batch_size` images, waiting at
+    most `max_wait` seconds after the first one arrives before running the model.
+    Receipts whose caller gave up (timeout passed or future cancelled) are
+    dropped before the model sees them.
+    """
+
+    def __init__(self, scanner, max_batch_size=8, max_wait=0.05):
+        self.scanner = scanner
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="receipt-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image, timeout=None):
+        """
+        Queue an image (path or PIL image). Returns a Future of (receipt_result, total_result),
+        cancelled instead if it is still queued `timeout` seconds from now.
+        """
+        future = Future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._queue.put((image, future, deadline))
+        return future
+
+    def verify(self, image, timeout=None):
+        future = self.submit(image, timeout)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = []
+            for image, future, deadline in self._collect():
+                if deadline is not None and time.monotonic() >= deadline:
+                    future.cancel()
+                if future.set_running_or_notify_cancel():
+                    batch.append((image, future))
+            if not batch:
+                continue
+
+            # The pipeline stacks a batch into one tensor, so images of one
+            # size go through together; padding them to a common size instead
+            # would shrink the text of every smaller receipt
+            groups = {}
+            for image, future in batch:
+                try:
+                    image = _load(image)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                groups.setdefault(image.size, []).append((image, future))
+
+            for group in groups.values():
+                self._scan(group)
+
+    def _scan(self, group):
+        # Two questions per image, interleaved so results line up in pairs
+        inputs = []
+        for image, _ in group:
+            inputs.append({'image': image, 'question': RECEIPT_QUESTION})
+            inputs.append({'image': image, 'question': TOTAL_QUESTION})
+        try:
+            results = self.scanner(inputs, batch_size=len(inputs))
+        except Exception as e:
+            for _, future in group:
+                future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(group):
+            future.set_result((results[2 * i], results[2 * i + 1]))
@@ -0,0 +1,184 @@
+"""
+Duplicate-receipt detection with perceptual hashes.
+
+Every processed receipt is reduced to a difference hash (dHash) and kept in a
+BK-tree, so a resent screenshot — even recompressed or resized by Telegram — is
+found by Hamming distance. Receipts from one banking app share a layout and
+differ only in a few lines of small text, which a 16x16 hash barely sees, so a
+match also needs the same total as read by the model. Each entry remembers the
+order it was paid for, so the same image turning up on a different order can
+be flagged. Entries expire after `max_age` seconds and the
+index never holds more than `maxsize` of them.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def dhash(image, hash_size=16):
+    """Difference hash of a PIL image as an int of hash_size * hash_size bits."""
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over int hashes; each node carries the keys stored under its hash."""
+
+    def __init__(self):
+        self.root = None  # [hash, keys, {distance: child}]
+
+    def add(self, value, key):
+        if self.root is None:
+            self.root = [value, [key], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [key], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """(distance, key) for every stored key within `radius` of `value`."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend((d, key) for key in node[1])
+            for edge, child in node[2].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return found
+
+
+class ReceiptEntry:
+    __slots__ = ('hash', 'verdict', 'total', 'chat_id', 'order_id', 'seen_at')
+
+    def __init__(self, hash, verdict, total, chat_id, order_id, seen_at):
+        self.hash = hash
+        self.verdict = verdict
+        self.total = total
+        self.chat_id = chat_id
+        self.order_id = order_id
+        self.seen_at = seen_at
+
+
+class ReceiptIndex:
+    """
+    `lookup(hash, total, order_id)` returns a stored ReceiptEntry within
+    `max_distance` bits that has the same `total`, or None; entries that paid
+    for a different order come first, then the closest.
+    `add(hash, verdict, total, chat_id, order_id)` records a verdict, and
+    `match(...)` does both, recording the receipt unless a paid entry covers it.
+    Evicted keys are dropped from the tree lazily: it is rebuilt from the live
+    entries once more than half of its keys are dead.
+    """
+
+    def __init__(self, max_distance=8, max_age=30 * 24 * 3600, maxsize=50000):
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> ReceiptEntry, oldest first
+        self._tree = BKTree()
+        self._tree_keys = 0
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0
+        self.evictions = 0
+
+    def lookup(self, value, total=None, order_id=None):
+        with self._lock:
+            return self._lookup(value, total, order_id)
+
+    def add(self, value, verdict, total=None, chat_id=None, order_id=None):
+        with self._lock:
+            self._add(value, verdict, total, chat_id, order_id)
+
+    def match(self, value, verdict, total=None, chat_id=None, order_id=None):
+        """
+        lookup() then record this receipt for `order_id`, unless the match is
+        already a paid entry (for this order, or a reuse of another's). An
+        approved resend of a receipt first rejected is recorded as paid, so
+        a later copy on another order is still caught.
+        """
+        with self._lock:
+            seen = self._lookup(value, total, order_id)
+            if seen is None or (verdict and not seen.verdict):
+                self._add(value, verdict, total, chat_id, order_id)
+            return seen
+
+    def _lookup(self, value, total, order_id):
+        self._expire()
+        matches = []
+        for d, key in self._tree.search(value, self.max_distance):
+            entry = self._entries.get(key)
+            if entry is not None and entry.total == total:
+                paid_elsewhere = bool(entry.verdict) and entry.order_id != order_id
+                matches.append((not paid_elsewhere, d, key))
+        if not matches:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._entries[min(matches)[2]]
+
+    def _add(self, value, verdict, total, chat_id, order_id):
+        key = next(self._keys)
+        self._entries[key] = ReceiptEntry(value, verdict, total, chat_id, order_id, time.time())
+        self._tree.add(value, key)
+        self._tree_keys += 1
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._expire()
+
+    def flag_reuse(self):
+        with self._lock:
+            self.reused += 1
+
+    def _expire(self):
+        cutoff = time.time() - self.max_age
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.seen_at >= cutoff:
+                break
+            del self._entries[key]
+            self.evictions += 1
+        if self._tree_keys > 2 * len(self._entries) + 64:
+            self._tree = BKTree()
+            for key, entry in self._entries.items():
+                self._tree.add(entry.hash, key)
+            self._tree_keys = len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'reused': self.reused,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,212 @@
+"""
+Receipt verification as background jobs.
+
+An uploaded receipt becomes a ReceiptJob with a priority and a deadline. A
+few worker threads take jobs in priority order; a job whose deadline has
+passed is never checked (or approved) — it goes to `on_expired` so a person
+can review it. VerdictCache remembers verdicts by image digest, so the same
+file sent again is answered without decoding or running the model, and a file
+first sent for another order is recognised as reused (by every process sharing
+its SQLite file).
+"""
+import hashlib
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+def image_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ReceiptJob:
+    __slots__ = ('chat_id', 'order_id', 'file_id', 'priority', 'submitted_at', 'deadline')
+
+    def __init__(self, chat_id, order_id, file_id, priority=0, timeout=60.0):
+        self.chat_id = chat_id
+        self.order_id = order_id
+        self.file_id = file_id
+        self.priority = priority
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + timeout
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+
+class ReceiptJobQueue:
+    """
+    Runs `process(job)` on `workers` threads, lowest priority value first
+    (FIFO within a priority). Jobs still queued at their deadline, and jobs
+    whose `process` raises, are passed to `on_expired(job, reason)` instead.
+    A reaper thread expires queued jobs as their deadlines pass, so they are
+    handed on even while every worker is busy. `submit` returns False when
+    `maxsize` jobs are already waiting.
+    """
+
+    def __init__(self, process, on_expired, workers=4, maxsize=500):
+        self.process = process
+        self.on_expired = on_expired
+        self.maxsize = maxsize
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self.done = 0
+        self.expired = 0
+        self.failed = 0
+        self.rejected = 0
+        self._submitted = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f"receipt-job-{i}", daemon=True)
+                         for i in range(workers)]
+        self._threads.append(threading.Thread(target=self._reap, name="receipt-job-reaper", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job):
+        with self._cond:
+            if len(self._heap) >= self.maxsize:
+                self.rejected += 1
+                return False
+            heapq.heappush(self._heap, (job.priority, next(self._counter), job))
+            self._cond.notify()
+        self._submitted.set()
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _next(self):
+        with self._cond:
+            while not self._heap:
+                self._cond.wait()
+            return heapq.heappop(self._heap)[2]
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job.remaining() <= 0:
+                with self._cond:
+                    self.expired += 1
+                self._expire(job, 'deadline')
+                continue
+            try:
+                self.process(job)
+                with self._cond:
+                    self.done += 1
+            except Exception as e:
+                print(f"Receipt job for chat {job.chat_id} failed: {e}")
+                if job.remaining() <= 0:
+                    # e.g. the download timed out at the job's deadline
+                    with self._cond:
+                        self.expired += 1
+                    self._expire(job, 'deadline')
+                    continue
+                traceback.print_exc()
+                with self._cond:
+                    self.failed += 1
+                self._expire(job, 'error')
+
+    def _reap(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                overdue = [entry[2] for entry in self._heap if entry[2].deadline <= now]
+                if overdue:
+                    self._heap = [entry for entry in self._heap if entry[2].deadline > now]
+                    heapq.heapify(self._heap)
+                    self.expired += len(overdue)
+                # Sleep until the earliest deadline, or until a new job arrives
+                wait = min(entry[2].deadline for entry in self._heap) - now if self._heap else None
+                self._submitted.clear()
+            for job in overdue:
+                self._expire(job, 'deadline')
+            if not overdue:
+                self._submitted.wait(wait)
+
+    def _expire(self, job, reason):
+        try:
+            self.on_expired(job, reason)
+        except Exception as e:
+            print(f"Could not hand receipt job for chat {job.chat_id} to manual review: {e}")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._heap),
+                'done': self.done,
+                'expired': self.expired,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
+
+
+class VerdictCache:
+    """
+    LRU of image digest -> (verdict, order_id the receipt was first sent for).
+    If `db_path` is given, verdicts are also written to SQLite (kept for
+    `max_age` seconds) and misses fall back to it, so processes sharing the
+    file (shard workers) recognise each other's receipts.
+    """
+
+    def __init__(self, maxsize=10000, db_path=None, max_age=30 * 24 * 3600):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts (digest TEXT PRIMARY KEY, verdict INTEGER, order_id TEXT, seen REAL)")
+            self._db.execute("DELETE FROM verdicts WHERE seen < ?", (time.time() - max_age,))
+            self._db.commit()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._data.get(digest)
+            if entry is None and self._db is not None:
+                entry = self._load(digest)
+                if entry is not None:
+                    self._store(digest, entry)
+                    self.disk_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(digest)
+            self.hits += 1
+            return entry
+
+    def set(self, digest, verdict, order_id=None):
+        with self._lock:
+            if digest in self._data:
+                # Keep the first order: a later order sending the same file is a reuse
+                self._data.move_to_end(digest)
+                return
+            entry = (verdict, order_id)
+            if self._db is not None:
+                self._db.execute("INSERT OR IGNORE INTO verdicts (digest, verdict, order_id, seen) VALUES (?, ?, ?, ?)",
+                                 (digest, int(verdict), order_id, time.time()))
+                self._db.commit()
+                # Another process may have stored this file first
+                entry = self._load(digest) or entry
+            self._store(digest, entry)
+
+    def _load(self, digest):
+        row = self._db.execute("SELECT verdict, order_id FROM verdicts WHERE digest = ?", (digest,)).fetchone()
+        return None if row is None else (bool(row[0]), row[1])
+
+    def _store(self, digest, entry):
+        self._data[digest] = entry
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
@@ -0,0 +1,87 @@
+"""
+Cheap pre-filter in front of the receipt VQA model.
+
+A few image statistics on a 256 px thumbnail (grayscale histogram, edge
+density, colour saturation) take milliseconds and are enough to reject
+obvious non-receipts (blank screenshots, colourful food photos and
+selfies). Everything else goes on to the model: looking like a receipt is not
+proof of payment, so the pre-filter never approves one on its own.
+"""
+import threading
+from collections import Counter
+
+from PIL import ImageFilter, ImageStat
+
+DEFAULT_THRESHOLDS = {
+    # Blank / near-uniform images
+    'blank_max_std': 8.0,
+    'blank_max_edges': 0.01,
+    # Colourful photos with little white background (food, selfies)
+    'photo_min_saturation': 0.35,
+    'photo_max_bright': 0.30,
+}
+
+
+def parse_thresholds(text):
+    """'photo_min_saturation=0.4,blank_max_std=6' -> {name: float}"""
+    overrides = {}
+    for pair in (text or '').split(','):
+        if '=' in pair:
+            name, value = pair.split('=', 1)
+            name = name.strip()
+            if name not in DEFAULT_THRESHOLDS:
+                raise ValueError(f"Unknown prefilter threshold: {name}")
+            overrides[name] = float(value)
+    return overrides
+
+
+def image_features(image):
+    """Cheap statistics of a PIL image, computed on a small thumbnail."""
+    small = image.copy()
+    small.thumbnail((256, 256))
+    gray = small.convert('L')
+
+    hist = gray.histogram()
+    total = float(sum(hist)) or 1.0
+    edges = gray.filter(ImageFilter.FIND_EDGES).histogram()
+
+    return {
+        'bright': sum(hist[200:]) / total,
+        'std': ImageStat.Stat(gray).stddev[0],
+        'edges': sum(edges[64:]) / total,
+        'saturation': ImageStat.Stat(small.convert('HSV')).mean[1] / 255.0,
+    }
+
+
+class ReceiptPrefilter:
+    """
+    `check(image)` returns ('reject', reason) for obvious non-receipts and
+    ('model', 'ambiguous') for everything else.
+    """
+
+    def __init__(self, thresholds=None):
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        self.thresholds.update(thresholds or {})
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    def classify(self, features):
+        t = self.thresholds
+        if features['std'] <= t['blank_max_std'] or features['edges'] <= t['blank_max_edges']:
+            return 'reject', 'blank'
+        if features['saturation'] >= t['photo_min_saturation'] and features['bright'] <= t['photo_max_bright']:
+            return 'reject', 'photo'
+        return 'model', 'ambiguous'
+
+    def check(self, image):
+        decision, reason = self.classify(image_features(image))
+        with self._lock:
+            self.outcomes[(decision, reason)] += 1
+        return decision, reason
+
+    def stats(self):
+        """Count and share of uploads per (decision, reason)."""
+        with self._lock:
+            total = sum(self.outcomes.values())
+            return {f"{decision}:{reason}": {'count': n, 'rate': n / total if total else 0.0}
+                    for (decision, reason), n in self.outcomes.items()}
@@ -0,0 +1,74 @@
+"""
+Finite-state-machine message router.
+
+Instead of every handler filter looking up the chat's step on its own, the
+router reads the step once per update and picks the handler from a
+(step, content_type) transition table. Per-step call counts and timings are
+kept for monitoring.
+"""
+import threading
+import time
+
+
+class StepRouter:
+    """
+    `get_step(chat_id)` must return the chat's current step without creating
+    state for unknown chats. Handlers are registered with `on()` and `default()`.
+    """
+
+    def __init__(self, get_step):
+        self.get_step = get_step
+        self.routes = {}    # (step, content_type) -> handler
+        self.defaults = {}  # content_type -> handler when no step route matches
+        self._stats = {}    # step -> [calls, total_seconds, max_seconds]
+        self._lock = threading.Lock()
+
+    def on(self, steps, content_types=('text',)):
+        """Decorator: handle `content_types` messages while the chat is in any of `steps`."""
+        def decorator(handler):
+            for step in steps:
+                for content_type in content_types:
+                    self.routes[(step, content_type)] = handler
+            return handler
+        return decorator
+
+    def default(self, content_types=('text',)):
+        """Decorator: handle messages that no step route matched."""
+        def decorator(handler):
+            for content_type in content_types:
+                self.defaults[content_type] = handler
+            return handler
+        return decorator
+
+    @property
+    def content_types(self):
+        return sorted({ct for _, ct in self.routes} | set(self.defaults))
+
+    def dispatch(self, message):
+        """Run the handler for this message's step. Returns False if nothing matched."""
+        step = self.get_step(message.chat.id)
+        handler = self.routes.get((step, message.content_type))
+        if handler is None:
+            handler = self.defaults.get(message.content_type)
+            if handler is None:
+                return False
+
+        t0 = time.perf_counter()
+        try:
+            handler(message)
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                stats = self._stats.get(step)
+                if stats is None:
+                    stats = self._stats[step] = [0, 0.0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+        return True
+
+    def timings(self):
+        """{step: {'calls', 'total_s', 'avg_s', 'max_s'}} since startup."""
+        with self._lock:
+            return {step: {'calls': calls, 'total_s': total, 'avg_s': total / calls if calls else 0.0, 'max_s': peak}
+                    for step, (calls, total, peak) in self._stats.items()}
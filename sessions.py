@@ -0,0 +1,260 @@
+"""
+Session stores for per-chat order state.
+
+Both stores behave like the dict `user_data` used to be (`store[chat_id]`,
+`store.get(chat_id)`, `chat_id in store`, `del store[chat_id]`) but stay
+bounded: least-recently-used chats are evicted past `maxsize` and chats idle
+longer than `ttl` seconds (abandoned carts) expire.
+
+MemorySessionStore keeps everything in process. SQLiteSessionStore adds a
+write-behind SQLite table so orders in progress survive restarts: state
+touched with `store[chat_id]` is marked dirty and written in batches by a
+background thread.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemorySessionStore:
+    """In-memory LRU + TTL session store."""
+
+    def __init__(self, maxsize=100000, ttl=24 * 3600):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data = OrderedDict()  # chat_id -> [last_touched, state]
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # --- dict-style API ---
+    def get(self, chat_id, default=None):
+        with self._lock:
+            state = self._lookup(chat_id)
+        return default if state is None else state
+
+    def __getitem__(self, chat_id):
+        with self._lock:
+            state = self._lookup(chat_id)
+            if state is None:
+                raise KeyError(chat_id)
+            # Callers mutate the returned dict in place, so assume it changed
+            self._touched(chat_id)
+            return state
+
+    def __setitem__(self, chat_id, state):
+        with self._lock:
+            now = time.time()
+            self._data[chat_id] = [now, state]
+            self._data.move_to_end(chat_id)
+            self._touched(chat_id)
+            self._trim(now)
+
+    def __delitem__(self, chat_id):
+        with self._lock:
+            self._data.pop(chat_id, None)
+            self._removed(chat_id)
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def chats_in_step(self, step):
+        """Chat ids whose live session is at `step`."""
+        with self._lock:
+            now = time.time()
+            return [chat_id for chat_id, (touched, state) in self._data.items()
+                    if now - touched <= self.ttl and state.get('step') == step]
+
+    # --- internals ---
+    def _lookup(self, chat_id):
+        now = time.time()
+        entry = self._data.get(chat_id)
+        if entry is None:
+            state = self._miss(chat_id)
+            if state is None:
+                self.misses += 1
+                return None
+            entry = self._data[chat_id] = [now, state]
+            self._trim(now)
+        elif now - entry[0] > self.ttl:
+            del self._data[chat_id]
+            self.expirations += 1
+            self._removed(chat_id)
+            self.misses += 1
+            return None
+        entry[0] = now
+        self._data.move_to_end(chat_id)
+        self.hits += 1
+        return entry[1]
+
+    def _trim(self, now):
+        while len(self._data) > self.maxsize:
+            chat_id, (_, state) = self._data.popitem(last=False)
+            self.evictions += 1
+            self._evicted(chat_id, state)
+        # Oldest-touched entries sit at the front, so expired ones are found first
+        while self._data:
+            chat_id, (touched, _) = next(iter(self._data.items()))
+            if now - touched <= self.ttl:
+                break
+            del self._data[chat_id]
+            self.expirations += 1
+            self._removed(chat_id)
+
+    # Hooks for persistent subclasses
+    def _miss(self, chat_id):
+        return None
+
+    def _touched(self, chat_id):
+        pass
+
+    def _evicted(self, chat_id, state):
+        pass
+
+    def _removed(self, chat_id):
+        pass
+
+    def flush(self):
+        return 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """
+    MemorySessionStore backed by SQLite with write-behind batching. Dirty chats
+    are written every `flush_interval` seconds, or sooner once `flush_batch`
+    of them are waiting. Chats evicted from memory are reloaded on demand.
+    """
+
+    def __init__(self, path, maxsize=100000, ttl=24 * 3600, flush_interval=2.0, flush_batch=500):
+        super().__init__(maxsize, ttl)
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, state TEXT, updated REAL)")
+        self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - ttl,))
+        self._db.commit()
+        self._db_lock = threading.Lock()
+
+        self._dirty = set()
+        self._pending = {}   # chat_id -> (json, updated) or None for delete; not yet flushed
+        self._flushing = {}  # same, currently being written
+        self.flushes = 0
+        self.rows_written = 0
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._thread.start()
+
+    def _miss(self, chat_id):
+        for writes in (self._pending, self._flushing):
+            if chat_id in writes:
+                row = writes[chat_id]
+                return None if row is None else json.loads(row[0])
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT state, updated FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def _touched(self, chat_id):
+        self._dirty.add(chat_id)
+        if len(self._dirty) >= self.flush_batch:
+            self._wake.set()
+
+    def _evicted(self, chat_id, state):
+        if chat_id in self._dirty:
+            self._dirty.discard(chat_id)
+            self._pending[chat_id] = (json.dumps(state), time.time())
+
+    def _removed(self, chat_id):
+        self._dirty.discard(chat_id)
+        self._pending[chat_id] = None
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Session flush failed: {e}")
+
+    def flush(self):
+        """Write all dirty sessions now. Returns the number of rows written."""
+        with self._lock:
+            writes = self._pending
+            self._pending = {}
+            for chat_id in self._dirty:
+                entry = self._data.get(chat_id)
+                if entry is None:
+                    continue
+                try:
+                    writes[chat_id] = (json.dumps(entry[1]), entry[0])
+                except (TypeError, ValueError, RuntimeError) as e:
+                    print(f"Could not serialize session {chat_id}: {e}")
+            self._dirty = set()
+            self._flushing = writes
+        if not writes:
+            return 0
+
+        upserts = [(chat_id, row[0], row[1]) for chat_id, row in writes.items() if row is not None]
+        deletes = [(chat_id,) for chat_id, row in writes.items() if row is None]
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO sessions (chat_id, state, updated) VALUES (?, ?, ?)", upserts)
+            self._db.executemany("DELETE FROM sessions WHERE chat_id = ?", deletes)
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+            self._db.commit()
+        with self._lock:
+            self._flushing = {}
+            self.flushes += 1
+            self.rows_written += len(writes)
+        return len(writes)
+
+    def chats_in_step(self, step):
+        """Chat ids at `step`, including sessions stored by an earlier run."""
+        self.flush()
+        with self._db_lock:
+            rows = self._db.execute("SELECT chat_id, state FROM sessions WHERE updated >= ?",
+                                    (time.time() - self.ttl,)).fetchall()
+        return [chat_id for chat_id, state in rows if json.loads(state).get('step') == step]
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                'dirty': len(self._dirty) + len(self._pending),
+                'flushes': self.flushes,
+                'rows_written': self.rows_written,
+            })
+        with self._db_lock:
+            stats['stored'] = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return stats
+
+
+def open_session_store(backend='memory', path='sessions.sqlite3', maxsize=100000, ttl=24 * 3600,
+                       flush_interval=2.0):
+    if backend == 'sqlite':
+        return SQLiteSessionStore(path, maxsize=maxsize, ttl=ttl, flush_interval=flush_interval)
+    if backend != 'memory':
+        raise ValueError(f"Unknown session backend: {backend}")
+    return MemorySessionStore(maxsize=maxsize, ttl=ttl)
@@ -0,0 +1,318 @@
+"""
+Multi-process mode: updates sharded by chat across worker processes.
+
+The dispatcher process receives updates (getUpdates or webhook) and puts each
+raw update on the queue of worker `chat_id % workers`, so a chat always lands
+on the same worker and its updates stay in order. Every worker re-runs app.py
+with its own bot, handler threads and session store (its slice of the chats).
+
+Receipt inference runs in a separate pool: the dispatcher loads the model once
+and forks the inference processes afterwards, so they share the weights
+copy-on-write. Workers send downscaled images to the pool and get the two VQA
+answers back on their own reply queue.
+
+Needs the 'fork' start method (Linux/macOS).
+"""
+import itertools
+import multiprocessing
+import os
+import queue
+import runpy
+import threading
+import time
+import traceback
+from concurrent.futures import Future, TimeoutError
+
+from telebot import apihelper
+
+from receipt_engine import ReceiptBatcher
+
+_current = None    # the Shard this process serves, set in worker processes
+_preloaded = None  # scanner loaded in the dispatcher before forking the inference pool
+
+
+def current_shard():
+    """The Shard this process serves, or None outside sharded mode's workers."""
+    return _current
+
+
+def shard_path(path, index):
+    """'sessions.sqlite3', 2 -> 'sessions.shard2.sqlite3'"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+
+def raw_chat_id(update):
+    """The chat id of a raw (dict) update, or None if it has none."""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = update.get(field)
+        if message:
+            return message['chat']['id']
+    callback = update.get('callback_query')
+    if callback and callback.get('message'):
+        return callback['message']['chat']['id']
+    return None
+
+
+def shard_of(update, count):
+    chat_id = raw_chat_id(update)
+    return (chat_id if chat_id is not None else update['update_id']) % count
+
+
+class InferenceClient:
+    """
+    A worker's handle on the inference pool, with the ReceiptBatcher interface
+    app.py uses: `verify(image, timeout)` -> (receipt_result, total_result).
+    """
+
+    def __init__(self, index, requests_queue, replies_queue):
+        self.index = index
+        self._requests = requests_queue
+        self._replies = replies_queue
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader = None
+
+    def submit(self, image, timeout=None):
+        return self._submit(image, timeout)[1]
+
+    def _submit(self, image, timeout):
+        with self._lock:
+            if self._reader is None:
+                # Started on first use, i.e. after the fork, in the worker itself
+                self._reader = threading.Thread(target=self._read_replies, name="inference-replies", daemon=True)
+                self._reader.start()
+            job_id = next(self._ids)
+            future = self._futures[job_id] = Future()
+        # Wall-clock deadline: the inference process drops the request once it has passed
+        deadline = None if timeout is None else time.time() + timeout
+        self._requests.put((self.index, job_id, image, deadline))
+        return job_id, future
+
+    def verify(self, image, timeout=None):
+        job_id, future = self._submit(image, timeout)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            with self._lock:
+                self._futures.pop(job_id, None)
+            future.cancel()
+            raise
+
+    def pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def _read_replies(self):
+        while True:
+            job_id, answers, error = self._replies.get()
+            with self._lock:
+                future = self._futures.pop(job_id, None)
+            if future is None:
+                continue
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(answers)
+
+
+class Shard:
+    """What a worker process needs from the dispatcher: its index, its update queue and the inference pool."""
+
+    def __init__(self, index, count, updates, inference=None, max_pending=1000):
+        self.index = index
+        self.count = count
+        self.updates = updates
+        self.inference = inference
+        self.max_pending = max_pending
+        self._exit_hooks = []
+
+    def at_exit(self, hook):
+        """
+        Run `hook()` when this worker stops. Forked workers leave through
+        os._exit, which skips atexit handlers, so flushing state goes here.
+        """
+        self._exit_hooks.append(hook)
+
+    def serve(self, bot):
+        """Feed this shard's updates to `bot` (a ChatOrderedBot) until the dispatcher stops."""
+        from telebot import types
+        while True:
+            # Backpressure: stop taking updates while this worker's handlers are behind,
+            # so the dispatcher's bounded queue fills and it slows down
+            while bot.executor.pending() >= self.max_pending:
+                time.sleep(0.01)
+            payload = self.updates.get()
+            if payload is None:
+                return
+            try:
+                bot.process_new_updates([types.Update.de_json(payload)])
+            except Exception as e:
+                print(f"Shard {self.index}: bad update {payload.get('update_id')}: {e}")
+
+
+def _shard_main(app_path, shard):
+    global _current
+    _current = shard
+    try:
+        runpy.run_path(app_path, run_name='__main__')
+    finally:
+        for hook in reversed(shard._exit_hooks):
+            try:
+                hook()
+            except Exception as e:
+                print(f"Shard {shard.index}: shutdown hook failed: {e}")
+
+
+def _inference_main(scanner_loader, requests_queue, replies_queues, batch_size, max_wait, threads):
+    scanner = _preloaded
+    if scanner is None:
+        try:
+            scanner = scanner_loader()
+        except Exception as e:
+            print(f"⚠️ Inference worker could not load the AI model: {e}")
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    batcher = ReceiptBatcher(scanner, max_batch_size=batch_size, max_wait=max_wait) if scanner else None
+
+    def reply(shard_index, job_id, future):
+        if future.cancelled():
+            # The worker has stopped waiting for it
+            return
+        try:
+            replies_queues[shard_index].put((job_id, future.result(), None))
+        except Exception as e:
+            replies_queues[shard_index].put((job_id, None, f"{type(e).__name__}: {e}"))
+
+    while True:
+        job = requests_queue.get()
+        if job is None:
+            return
+        shard_index, job_id, image, deadline = job
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+            continue
+        if batcher is None:
+            replies_queues[shard_index].put((job_id, None, "AI model not available"))
+            continue
+        future = batcher.submit(image, timeout=remaining)
+        future.add_done_callback(lambda f, s=shard_index, j=job_id: reply(s, j, f))
+
+
+class ShardDispatcher:
+    """
+    Starts `workers` app.py processes and `inference_workers` model processes,
+    then routes raw updates to workers by chat. `scanner_loader()` loads the
+    VQA scanner; it runs once, in this process, before the pool is forked.
+    """
+
+    def __init__(self, app_path, workers, scanner_loader=None, inference_workers=1,
+                 queue_size=1000, batch_size=8, max_wait=0.05, threads=None):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("Sharded mode needs the 'fork' start method (Linux/macOS)")
+        self.app_path = app_path
+        self.count = workers
+        self.scanner_loader = scanner_loader
+        self.inference_workers = inference_workers if scanner_loader else 0
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.threads = threads
+        self.ctx = multiprocessing.get_context('fork')
+        self.queues = []
+        self.requests_queue = None
+        self.processes = []
+
+    def start(self):
+        global _preloaded
+        ctx = self.ctx
+        self.queues = [ctx.Queue(self.queue_size) for _ in range(self.count)]
+        self.requests_queue = requests_queue = ctx.Queue()
+        replies_queues = [ctx.Queue() for _ in range(self.count)]
+
+        # Workers first, so they don't inherit the model they never use
+        for index in range(self.count):
+            inference = None
+            if self.inference_workers:
+                inference = InferenceClient(index, requests_queue, replies_queues[index])
+            shard = Shard(index, self.count, self.queues[index], inference, max_pending=self.queue_size)
+            self._spawn(f"shard-{index}", _shard_main, (self.app_path, shard))
+
+        if self.inference_workers:
+            try:
+                print("⏳ Loading the shared AI model for the inference pool...")
+                _preloaded = self.scanner_loader()
+            except Exception as e:
+                # Each inference process retries the load itself
+                print(f"⚠️ Could not preload AI model: {e}")
+            args = (self.scanner_loader, requests_queue, replies_queues, self.batch_size, self.max_wait, self.threads)
+            for index in range(self.inference_workers):
+                self._spawn(f"inference-{index}", _inference_main, args)
+        print(f"✅ {self.count} shard workers and {self.inference_workers} inference workers started")
+        return self
+
+    def _spawn(self, name, target, args):
+        process = self.ctx.Process(target=target, args=args, name=name, daemon=True)
+        process.start()
+        self.processes.append(process)
+
+    # --- routing (also the interface WebhookServer uses) ---
+    def dispatch(self, payload):
+        self.queues[shard_of(payload, self.count)].put(payload)
+
+    def pending(self):
+        try:
+            return sum(q.qsize() for q in self.queues)
+        except NotImplementedError:
+            return 0
+
+    def check_workers(self):
+        """Raise if a worker process has died (a supervisor restarts the whole group)."""
+        for process in self.processes:
+            if not process.is_alive():
+                raise RuntimeError(f"{process.name} exited with code {process.exitcode}")
+
+    def poll(self, token, timeout=20):
+        """getUpdates loop feeding the shards (blocks while a shard's queue is full)."""
+        offset = None
+        while True:
+            self.check_workers()
+            try:
+                updates = apihelper.get_updates(token, offset=offset, timeout=timeout, long_polling_timeout=timeout)
+            except Exception as e:
+                print(f"getUpdates failed: {e}")
+                time.sleep(1)
+                continue
+            for payload in updates:
+                offset = payload['update_id'] + 1
+                self.dispatch(payload)
+
+    def stop(self):
+        for q in self.queues:
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+        if self.requests_queue is not None:
+            for _ in range(self.inference_workers):
+                self.requests_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def run_polling(self, token):
+        try:
+            self.poll(token)
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(f"❌ Dispatcher stopped: {e}")
+            traceback.print_exc()
+        finally:
+            self.stop()
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from gazetteer import Gazetteer, build_index
+
+SAMPLE_CSV = os.path.join(os.path.dirname(__file__), '..', 'data', 'gazetteer_sample.csv')
+
+
+@pytest.fixture(scope='module')
+def gazetteer(tmp_path_factory):
+    index_path = tmp_path_factory.mktemp('gazetteer') / 'gazetteer.json.gz'
+    build_index(SAMPLE_CSV, str(index_path))
+    return Gazetteer.load(str(index_path))
+
+
+@pytest.mark.parametrize('query', [
+    "123 Jalan Bukit Bintang, Kuala Lumpur",
+    "Lot 5, Jalan Ampang, Kuala Lumpur",
+    "Jalan Ampang, Kuala Lumpur",
+])
+def test_street_address_falls_through_to_nominatim(gazetteer, query):
+    assert gazetteer.search(query) == []
+
+
+def test_landmark_resolves_locally(gazetteer):
+    result = gazetteer.search("Menara Maybank, KL")
+    assert result[0]['display_name'].startswith("Menara Maybank")
+    assert result[0]['source'] == 'gazetteer'
+
+
+def test_bare_city_resolves_locally(gazetteer):
+    result = gazetteer.search("Kuala Lumpur")
+    assert result[0]['display_name'].startswith("Kuala Lumpur")
+
+
+def test_reverse_never_returns_the_city_centroid(gazetteer):
+    assert gazetteer.reverse(3.1390, 101.6869) is None
+    assert gazetteer.reverse(3.1420, 101.6890) is None
+
+
+def test_reverse_is_building_scale(gazetteer):
+    assert gazetteer.reverse(3.1466, 101.6958)['display_name'].startswith("Menara Maybank")
+    # ~300 m away from Menara Maybank: the customer's own street, not the tower
+    assert gazetteer.reverse(3.1493, 101.6958) is None
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+
+from geocoding import GeocoderUnavailable, NominatimClient
+
+FOUND = [{'display_name': 'Menara Maybank', 'lat': '3.1466', 'lon': '101.6958'}]
+
+
+def client_with(answers):
+    """A client whose searches answer from `answers` (a result list or an exception) and are recorded."""
+    client = NominatimClient(rate=0)
+    client.asked = []
+
+    def search(query, cancel=None):
+        client.asked.append(query)
+        answer = answers[query]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    client.search = search
+    return client
+
+
+def test_exact_hit_sends_no_fallbacks():
+    client = client_with({'exact': FOUND, 'cleaned': FOUND, 'short': FOUND})
+    assert client.search_first(['exact', 'cleaned', 'short']) == (0, FOUND)
+    assert client.asked == ['exact']
+
+
+def test_fallback_used_after_exact_miss():
+    client = client_with({'exact': [], 'cleaned': [], 'short': FOUND})
+    assert client.search_first(['exact', 'cleaned', 'short']) == (2, FOUND)
+
+
+def test_timeout_is_not_reported_as_not_found():
+    client = client_with({'exact': TimeoutError("read timed out"), 'cleaned': [], 'short': []})
+    with pytest.raises(GeocoderUnavailable):
+        client.search_first(['exact', 'cleaned', 'short'])
+
+
+def test_nothing_found():
+    client = client_with({'exact': [], 'cleaned': []})
+    assert client.search_first(['exact', 'cleaned']) == (None, [])
+
+
+class BrokenCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        raise RuntimeError("database is locked")
+
+
+def test_cache_write_failure_still_answers_every_waiter():
+    client = NominatimClient(rate=0, cache=BrokenCache())
+    release = threading.Event()
+
+    def slow_get(path, params, cancel=None):
+        release.wait(5)
+        return FOUND
+
+    client._get = slow_get
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(client.search('Menara Maybank')), daemon=True)
+               for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    release.set()
+    for waiter in waiters:
+        waiter.join(timeout=5)
+    assert results == [FOUND] * 3
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from receipt_engine import ReceiptBatcher, read_total
+
+
+def stacking_scanner(inputs, batch_size=None):
+    """Stand-in for the HF pipeline: fails like torch.cat on mixed image shapes."""
+    sizes = {item['image'].size for item in inputs}
+    if len(sizes) > 1:
+        raise RuntimeError(f"stack expects each tensor to be equal size, got {sorted(sizes)}")
+    return [{'answer': 'yes', 'score': 0.9, 'size': item['image'].size} for item in inputs]
+
+
+def test_differently_sized_images_share_one_batch():
+    batcher = ReceiptBatcher(stacking_scanner, max_batch_size=3, max_wait=1.0)
+    tall = batcher.submit(Image.new('RGB', (288, 640), 'white'))
+    wide = batcher.submit(Image.new('RGB', (640, 480), 'white'))
+    other_tall = batcher.submit(Image.new('RGB', (288, 640), 'white'))
+
+    # Each receipt reaches the model at its own size, whatever its batchmates
+    assert tall.result(timeout=5)[0]['size'] == (288, 640)
+    assert wide.result(timeout=5)[0]['size'] == (640, 480)
+    assert other_tall.result(timeout=5)[0]['size'] == (288, 640)
+
+
+def test_answer_does_not_depend_on_batchmates():
+    receipt = Image.new('RGB', (288, 640), 'white')
+    alone = ReceiptBatcher(stacking_scanner, max_batch_size=1).verify(receipt, timeout=5)
+
+    batcher = ReceiptBatcher(stacking_scanner, max_batch_size=2, max_wait=1.0)
+    batched = batcher.submit(receipt)
+    batcher.submit(Image.new('RGB', (640, 480), 'white'))
+    assert batched.result(timeout=5) == alone
+
+
+@pytest.mark.parametrize('answer, total', [('RM 24.50', '24.50'), ('rm24.50', '24.50'), ('24.50', '24.50'), ('', None)])
+def test_read_total_normalises_the_answer(answer, total):
+    assert read_total([{'answer': answer, 'score': 0.9}]) == total
+
+
+def test_abandoned_receipts_never_reach_the_model():
+    seen = []
+
+    def slow_scanner(inputs, batch_size=None):
+        seen.append(inputs[0]['image'].size)
+        time.sleep(0.5)
+        return [{'answer': 'yes', 'score': 0.9}] * len(inputs)
+
+    batcher = ReceiptBatcher(slow_scanner, max_batch_size=1, max_wait=0)
+    first = batcher.submit(Image.new('RGB', (10, 10), 'white'))
+    time.sleep(0.05)
+    for width in range(20, 24):
+        with pytest.raises(TimeoutError):
+            batcher.verify(Image.new('RGB', (width, 10), 'white'), timeout=0.1)
+    first.result(timeout=5)
+    time.sleep(0.2)
+    assert seen == [(10, 10)]
@@ -0,0 +1,47 @@
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from receipt_hashes import ReceiptIndex, dhash
+
+
+def test_lookalike_receipt_needs_the_same_total():
+    index = ReceiptIndex(max_distance=8)
+    index.add(0b1011, True, '24.50', chat_id=1, order_id='a')
+
+    # Two bits away: a recompressed copy, or another receipt from the same banking app
+    assert index.lookup(0b0001, '24.50').order_id == 'a'
+    assert index.lookup(0b0001, '31.00') is None
+
+
+def test_distance_is_bounded():
+    index = ReceiptIndex(max_distance=8)
+    index.add(0, True, '24.50', order_id='a')
+    assert index.lookup((1 << 8) - 1, '24.50') is not None
+    assert index.lookup((1 << 9) - 1, '24.50') is None
+
+
+def test_resized_copy_hashes_close():
+    image = Image.new('RGB', (300, 600), 'white')
+    image.paste((200, 30, 60), (0, 0, 300, 80))
+    image.paste((0, 0, 0), (20, 200, 280, 240))
+    copy = image.resize((210, 420))
+    assert bin(dhash(image) ^ dhash(copy)).count('1') <= 8
+
+
+def test_reject_then_approve_then_reuse_is_flagged():
+    index = ReceiptIndex(max_distance=8)
+    # Order A: a blurry upload is rejected, then a clearer resend is approved
+    assert index.match(0b1011, False, '24.50', order_id='A') is None
+    assert index.match(0b1001, True, '24.50', order_id='A').verdict is False
+
+    # A recompressed copy on order B matches A's paid entry
+    seen = index.match(0b0001, True, '24.50', order_id='B')
+    assert (seen.order_id, seen.verdict) == ('A', True)
+
+
+def test_paid_entry_of_another_order_beats_a_closer_match():
+    index = ReceiptIndex(max_distance=8)
+    index.add(0b111, True, '24.50', order_id='A')
+    index.add(0b000, False, '24.50', order_id='B')
+    assert index.lookup(0b000, '24.50', order_id='B').order_id == 'A'
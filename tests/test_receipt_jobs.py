@@ -0,0 +1,53 @@
+import threading
+import time
+
+from receipt_jobs import ReceiptJob, ReceiptJobQueue, VerdictCache
+
+
+def test_queued_job_expires_while_every_worker_is_busy():
+    release = threading.Event()
+    expired = []
+    queue = ReceiptJobQueue(lambda job: release.wait(5),
+                            on_expired=lambda job, reason: expired.append((job.chat_id, reason)),
+                            workers=1)
+    try:
+        queue.submit(ReceiptJob(1, 'a', 'file-a', timeout=10))
+        queue.submit(ReceiptJob(2, 'b', 'file-b', timeout=0.1))
+
+        deadline = time.monotonic() + 2
+        while not expired and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert expired == [(2, 'deadline')]
+        assert queue.stats()['pending'] == 0
+    finally:
+        release.set()
+
+
+def test_failure_past_the_deadline_counts_as_expired():
+    expired = []
+    done = threading.Event()
+
+    def slow_download(job):
+        time.sleep(0.2)
+        raise TimeoutError("read timed out")
+
+    queue = ReceiptJobQueue(slow_download,
+                            on_expired=lambda job, reason: (expired.append(reason), done.set()),
+                            workers=1)
+    queue.submit(ReceiptJob(1, 'a', 'file-a', timeout=0.1))
+    assert done.wait(2)
+    assert expired == ['deadline']
+
+
+def test_verdicts_are_shared_through_the_database(tmp_path):
+    path = str(tmp_path / 'verdicts.sqlite3')
+    shard0 = VerdictCache(db_path=path)
+    shard1 = VerdictCache(db_path=path)
+
+    shard0.set('digest', True, 'order-a')
+    assert shard1.get('digest') == (True, 'order-a')
+
+    # The first order stays the owner, whichever process stores it later
+    shard1.set('other', True, 'order-b')
+    shard0.set('other', True, 'order-c')
+    assert shard0.get('other') == (True, 'order-b')
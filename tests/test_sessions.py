@@ -0,0 +1,21 @@
+from sessions import MemorySessionStore, SQLiteSessionStore
+
+
+def test_memory_store_finds_chats_by_step():
+    store = MemorySessionStore()
+    store[1] = {'step': 'verifying_receipt'}
+    store[2] = {'step': 'uploading_proof'}
+    assert store.chats_in_step('verifying_receipt') == [1]
+
+
+def test_sqlite_store_finds_sessions_from_an_earlier_run(tmp_path):
+    path = str(tmp_path / 'sessions.sqlite3')
+    before = SQLiteSessionStore(path, flush_interval=60)
+    before[1] = {'step': 'verifying_receipt'}
+    before[2] = {'step': 'selecting_food'}
+    before.flush()
+
+    after = SQLiteSessionStore(path, flush_interval=60)
+    assert after.chats_in_step('verifying_receipt') == [1]
+    after[1]['step'] = 'uploading_proof'
+    assert after.chats_in_step('verifying_receipt') == []
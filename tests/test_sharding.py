@@ -0,0 +1,52 @@
+import queue
+import time
+
+import pytest
+
+pytest.importorskip("telebot")
+Image = pytest.importorskip("PIL.Image")
+
+import sharding
+from sharding import InferenceClient, Shard, _inference_main, _shard_main
+
+
+def test_expired_inference_requests_are_dropped():
+    scanned = []
+
+    def scanner(inputs, batch_size=None):
+        scanned.extend(item['image'].size for item in inputs[::2])
+        return [{'answer': 'yes', 'score': 0.9}] * len(inputs)
+
+    requests_queue, replies = queue.Queue(), queue.Queue()
+    requests_queue.put((0, 1, Image.new('RGB', (10, 10)), time.time() - 1))
+    requests_queue.put((0, 2, Image.new('RGB', (20, 20)), time.time() + 5))
+    requests_queue.put(None)
+    _inference_main(lambda: scanner, requests_queue, [replies], batch_size=4, max_wait=0, threads=None)
+
+    job_id, answers, error = replies.get(timeout=5)
+    assert (job_id, error) == (2, None)
+    assert scanned == [(20, 20)]
+
+
+def test_client_forgets_requests_it_stopped_waiting_for():
+    requests_queue = queue.Queue()
+    client = InferenceClient(0, requests_queue, queue.Queue())
+    with pytest.raises(TimeoutError):
+        client.verify(Image.new('RGB', (10, 10)), timeout=0.05)
+    assert client.pending() == 0
+    _, _, _, deadline = requests_queue.get_nowait()
+    assert deadline <= time.time()
+
+
+def test_exit_hooks_run_when_the_worker_stops(tmp_path):
+    marker = tmp_path / 'flushed'
+    app = tmp_path / 'app.py'
+    app.write_text("from sharding import current_shard\n"
+                   f"current_shard().at_exit(lambda: open({str(marker)!r}, 'w').close())\n")
+    updates = queue.Queue()
+    updates.put(None)
+    try:
+        _shard_main(str(app), Shard(0, 2, updates))
+    finally:
+        sharding._current = None
+    assert marker.exists()
@@ -0,0 +1,42 @@
+import pytest
+
+telebot = pytest.importorskip("telebot")
+
+from workers import ChatOrderedBot
+
+
+class RecordingExecutor:
+    """Never runs anything, like a ChatExecutor whose chat is busy."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, chat_id, fn, *args, **kwargs):
+        self.submitted.append((chat_id, args))
+
+
+def make_update(update_id, chat_id=42, text="1"):
+    return telebot.types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'text': text,
+                    'chat': {'id': chat_id, 'type': 'private'}},
+    })
+
+
+def test_queued_update_is_not_fetched_again():
+    executor = RecordingExecutor()
+    bot = ChatOrderedBot("123:TEST", executor)
+    pending = [make_update(100)]
+    offsets = []
+
+    def get_updates(offset=None, *args, **kwargs):
+        offsets.append(offset)
+        return [u for u in pending if offset is None or u.update_id >= offset]
+
+    bot.get_updates = get_updates
+    bot._TeleBot__retrieve_updates(timeout=0, long_polling_timeout=0)
+    bot._TeleBot__retrieve_updates(timeout=0, long_polling_timeout=0)
+
+    assert len(executor.submitted) == 1
+    assert offsets[-1] == 101
+    assert bot.last_update_id == 100
@@ -0,0 +1,174 @@
+"""
+Webhook serving mode.
+
+Instead of a getUpdates loop, Telegram POSTs each update to an embedded HTTP
+server. The server parses the update, hands it to the bot's ChatExecutor
+(so one chat's updates still run in order) and answers 200 straight away.
+When more than `max_pending` updates are waiting it answers 503 instead,
+and Telegram redelivers the update later. Redelivered updates that were
+already accepted are dropped by update_id.
+
+Recorded updates can be replayed against a local server:
+    python webhook.py post updates.jsonl --url http://127.0.0.1:8443/telegram [--secret ...]
+"""
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import telebot
+
+MAX_BODY_BYTES = 1024 * 1024
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class RecentUpdates:
+    """The last `maxsize` update_ids seen, to drop Telegram's redeliveries."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, update_id):
+        """False if update_id was already seen."""
+        with self._lock:
+            if update_id in self._ids:
+                return False
+            self._ids[update_id] = None
+            if len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+            return True
+
+
+class WebhookServer:
+    """
+    Serves `bot` (a ChatOrderedBot) on http://host:port/path. GET on any path
+    is a health check for load balancers. With a `dispatcher` (sharding.ShardDispatcher)
+    instead of a bot, raw updates are routed to its worker processes.
+    """
+
+    def __init__(self, bot=None, path='/telegram', host='0.0.0.0', port=8443,
+                 secret_token=None, max_pending=1000, metrics=None, dispatcher=None):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.path = '/' + path.strip('/')
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.metrics = metrics
+        self.recent = RecentUpdates()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    def _count(self, result):
+        if self.metrics is not None:
+            self.metrics.inc('webhook_updates_total', result=result)
+
+    def accept(self, body):
+        """Queue one update from a request body. Returns the HTTP status to answer with."""
+        try:
+            payload = json.loads(body)
+            update_id = payload['update_id']
+            update = telebot.types.Update.de_json(payload) if self.dispatcher is None else None
+        except Exception as e:
+            print(f"Bad webhook payload: {e}")
+            self._count('invalid')
+            return 400
+        pending = self.bot.executor.pending() if self.dispatcher is None else self.dispatcher.pending()
+        if pending >= self.max_pending:
+            # Telegram retries non-2xx answers, so shedding load here loses nothing
+            self._count('rejected')
+            return 503
+        if not self.recent.add(update_id):
+            self._count('duplicate')
+            return 200
+        if self.dispatcher is None:
+            self.bot.process_new_updates([update])
+        else:
+            self.dispatcher.dispatch(payload)
+        self._count('accepted')
+        return 200
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                if status == 503:
+                    self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._reply(200, b'ok')
+
+            def do_POST(self):
+                if self.path.split('?')[0] != server.path:
+                    self._reply(404)
+                    return
+                if server.secret_token and self.headers.get(SECRET_HEADER) != server.secret_token:
+                    self._reply(403)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > MAX_BODY_BYTES:
+                    self._reply(413 if length else 400)
+                    return
+                self._reply(server.accept(self.rfile.read(length)))
+
+        return Handler
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve on a daemon thread."""
+        threading.Thread(target=self.serve_forever, name="webhook-server", daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+def post_updates(path, url, secret_token=None, delay=0.0):
+    """POST every update in a JSONL (or JSON array) file to a webhook URL; returns status counts."""
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    updates = json.loads(text) if text.startswith('[') else [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    headers = {'Content-Type': 'application/json'}
+    if secret_token:
+        headers[SECRET_HEADER] = secret_token
+    counts = {}
+    with requests.Session() as session:
+        for update in updates:
+            status = session.post(url, data=json.dumps(update), headers=headers, timeout=10).status_code
+            counts[status] = counts.get(status, 0) + 1
+            if delay:
+                time.sleep(delay)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook tools.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    post = sub.add_parser('post', help="replay recorded updates against a webhook")
+    post.add_argument('updates', help="JSONL file (or JSON array) of Telegram updates")
+    post.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    post.add_argument('--secret')
+    post.add_argument('--delay', type=float, default=0.0, help="seconds between updates")
+    args = parser.parse_args()
+
+    counts = post_updates(args.updates, args.url, secret_token=args.secret, delay=args.delay)
+    print(" ".join(f"{status}: {n}" for status, n in sorted(counts.items())))
+
+
+if __name__ == '__main__':
+    main()
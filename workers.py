@@ -0,0 +1,149 @@
+"""
+Concurrent update handling with per-chat ordering.
+
+ChatExecutor runs work on a thread pool but never runs two tasks for the same
+chat at once, so one customer's slow receipt scan or address lookup only
+delays that customer. Scheduler runs delayed jobs (e.g. the "Rider Picked Up"
+message) without a sleeping handler thread.
+"""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+
+class ChatExecutor:
+    """Thread pool that serializes tasks per chat and runs different chats in parallel."""
+
+    def __init__(self, max_workers=16):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-worker')
+        self._queues = {}  # chat_id -> deque of pending (fn, args, kwargs)
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def submit(self, chat_id, fn, *args, **kwargs):
+        with self._lock:
+            pending = self._queues.get(chat_id)
+            start = pending is None
+            if start:
+                pending = self._queues[chat_id] = deque()
+            pending.append((fn, args, kwargs))
+        # Only one drain job per chat, so that chat's tasks run in arrival order
+        if start:
+            self._pool.submit(self._drain, chat_id)
+
+    def _drain(self, chat_id):
+        while True:
+            with self._lock:
+                pending = self._queues[chat_id]
+                if not pending:
+                    del self._queues[chat_id]
+                    return
+                fn, args, kwargs = pending.popleft()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"Error handling update for chat {chat_id}: {e}")
+                traceback.print_exc()
+
+    def pending(self):
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def active_chats(self):
+        with self._lock:
+            return len(self._queues)
+
+
+class Scheduler:
+    """
+    Runs `fn(*args)` after a delay on one timer thread. Jobs with a `chat_id`
+    are handed to the ChatExecutor so they stay ordered with that chat's updates.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, fn, *args, chat_id=None):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), chat_id, fn, args))
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due = self._heap[0][0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                _, _, chat_id, fn, args = heapq.heappop(self._heap)
+
+            if self.executor is not None and chat_id is not None:
+                self.executor.submit(chat_id, fn, *args)
+                continue
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Scheduled job failed: {e}")
+                traceback.print_exc()
+
+
+def update_chat_id(update):
+    """The chat an update belongs to, or a per-update key if it has none."""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, field, None)
+        if message is not None:
+            return message.chat.id
+    callback = getattr(update, 'callback_query', None)
+    if callback is not None and callback.message is not None:
+        return callback.message.chat.id
+    return ('update', update.update_id)
+
+
+class ChatOrderedBot(telebot.TeleBot):
+    """
+    TeleBot whose updates are dispatched on a ChatExecutor instead of inline in
+    the polling thread. Handlers (and their step filters) for one chat still see
+    that chat's updates strictly in order.
+    `around_update(label, fn)`, if given, wraps each update's dispatch (timing/profiling).
+    """
+
+    def __init__(self, token, executor, around_update=None, **kwargs):
+        kwargs['threaded'] = False
+        super().__init__(token, **kwargs)
+        self.executor = executor
+        self.around_update = around_update
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Telebot only advances the getUpdates offset when it dispatches, which
+            # now happens later on a worker; without this the next poll refetches
+            # (and resubmits) every update still queued behind a busy chat
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.executor.submit(update_chat_id(update), self._dispatch, update)
+
+    def _dispatch(self, update):
+        dispatch = super().process_new_updates
+        if self.around_update is None:
+            return dispatch([update])
+        return self.around_update(f"update-{update.update_id}", lambda: dispatch([update]))